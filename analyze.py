@@ -0,0 +1,230 @@
+"""
+Streaming analysis of positions: scores every legal move of every position in the input
+
+Reads one position per line from a file or stdin and writes one JSON object per line to stdout, in input order.
+A line is either a position in compact notation, or a JSON object with the position under "position" and optionally
+"k" (pieces in a row to win) and any other fields, which are copied to the output.
+The compact notation lists the rows from top to bottom, separated by '/', with 'x', 'o' and '.' for the squares,
+e.g. 'x.o/.x./..o'. The player to move follows from the number of pieces.
+
+Every legal move is scored with score_move of an agent described as in tournament.py. Results are cached by
+canonical position, so rotations and reflections of a position that was already analyzed are not scored again.
+With --workers the positions are scored in a pool of processes, while at most a bounded number of them is read ahead.
+
+Example:
+    python analyze.py positions.jsonl --agent nstep:nsteps=4 --workers 4 > scores.jsonl
+"""
+
+import argparse
+import json
+import sys
+from collections import OrderedDict, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+
+import tictactoe_engine as te
+import tournament
+
+PIECES = {'x': 0, 'o': 1}
+
+_pool_agents = {}  # agent description -> the agent a pool process scores with
+
+
+def parse_position(notation, k=3):
+    """returns the GameBoard for a position in compact notation"""
+    rows = notation.strip().lower().split('/')
+    if len({len(row) for row in rows}) != 1:
+        raise ValueError('all rows must have the same length')
+    board = te.GameBoard(rows=len(rows), cols=len(rows[0]), k=k)
+
+    squares = [[], []]
+    for row, row_text in enumerate(rows):
+        for col, piece in enumerate(row_text):
+            if piece in PIECES:
+                squares[PIECES[piece]].append((row, col))
+            elif piece != '.':
+                raise ValueError('unknown piece {0!r}'.format(piece))
+    if len(squares[0]) - len(squares[1]) not in (0, 1):
+        raise ValueError('X must have as many pieces as O or one more')
+
+    # alternate the pieces so that the board has a consistent move history and player to move
+    for index in range(0, len(squares[0]) + len(squares[1])):
+        player = index % 2
+        move_row, move_col = squares[player][index // 2]
+        board.place_piece(row=move_row, col=move_col, player=player)
+    return board
+
+
+def format_position(board):
+    return '/'.join(''.join(row) for row in board.board).lower()
+
+
+def score_moves(spec, rows, cols, k, moves):
+    """
+    the score of every legal move, by square index, on the position reached by moves, as given by score_move of
+    the agent described by spec. Runs in a pool process or, without workers, in the main one
+    """
+    agent = _pool_agents.get(spec)
+    if agent is None:
+        agent = tournament.build_agent(spec)
+        _pool_agents[spec] = agent
+
+    board = te.GameBoard(rows=rows, cols=cols, k=k)
+    for move_row, move_col, player in moves:
+        board.place_piece(row=move_row, col=move_col, player=player)
+    return {cols * move_row + move_col: agent.score_move((move_row, move_col), board)
+            for move_row, move_col in board.get_legal_moves()}
+
+
+def canonical_form(board):
+    """
+    (key, symmetry): the key shared by all symmetric variants of the position on board, and the index of the symmetry
+    that maps board onto the variant the key was taken from
+    """
+    x_bits, o_bits = board.bitboards
+    geometry = board.geometry
+    keys = [geometry.transform(x_bits, symmetry) | geometry.transform(o_bits, symmetry) << board.num_squares
+            for symmetry in range(0, len(geometry.symmetries))]
+    symmetry = keys.index(min(keys))
+    return (board.rows, board.cols, board.k, keys[symmetry]), symmetry
+
+
+class Analyzer:
+    """
+    Scores positions, in a pool of workers processes if workers is set, and caches the scores of up to cache_size
+    canonical positions
+    """
+
+    def __init__(self, spec='nstep', workers=None, cache_size=2 ** 16):
+        tournament.parse_agent_spec(spec)
+        self.spec = spec
+        self.pool = ProcessPoolExecutor(max_workers=workers) if workers else None
+        self.read_ahead = 4 * workers if workers else 1
+        self.cache_size = cache_size
+        self.cache = OrderedDict()  # canonical key -> scores by square index of the canonical variant
+        self.in_flight = {}  # canonical key -> (future, permutation) for positions that are being scored
+        self.hits = 0
+        self.misses = 0
+
+    def submit(self, board):
+        """
+        starts scoring the position on board unless its scores are cached or already being computed.
+        Returns (key, symmetry, job, cached), where job is the (future, permutation) that gives the scores; the
+        permutation is None when the future already gives the scores of the canonical variant
+        """
+        key, symmetry = canonical_form(board)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            future = Future()
+            future.set_result(self.cache[key])
+            return key, symmetry, (future, None), True
+        if key in self.in_flight:
+            self.hits += 1
+            return key, symmetry, self.in_flight[key], True
+
+        self.misses += 1
+        arguments = (self.spec, board.rows, board.cols, board.k, list(board.moves))
+        if self.pool is None:
+            future = Future()
+            try:
+                future.set_result(score_moves(*arguments))
+            except ValueError as error:
+                future.set_exception(error)
+        else:
+            future = self.pool.submit(score_moves, *arguments)
+        # the scores come back by square of board; the permutation turns them into those of the canonical variant
+        self.in_flight[key] = (future, board.geometry.symmetries[symmetry])
+        return key, symmetry, self.in_flight[key], False
+
+    def canonical_scores(self, key, job):
+        """the scores of the canonical variant of key, from job; scores that were not cached yet are cached"""
+        future, permutation = job
+        if permutation is None:
+            return future.result()
+        if key in self.cache:
+            return self.cache[key]
+        try:
+            scores = {permutation[index]: score for index, score in future.result().items()}
+        finally:
+            self.in_flight.pop(key, None)
+        self.cache[key] = scores
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return scores
+
+    def analyze(self, lines, k=3):
+        """yields an output record for every input line, in order, reading at most read_ahead lines ahead"""
+        pending = deque()
+        for line in lines:
+            if not line.strip():
+                continue
+            pending.append(self.start(line, k))
+            while len(pending) > self.read_ahead or (pending and pending[0][1] is None):
+                yield self.finish(*pending.popleft())
+        while pending:
+            yield self.finish(*pending.popleft())
+
+    def start(self, line, k):
+        """parses a line and starts scoring it; returns (record, work) where work is None for lines with an error"""
+        try:
+            record = json.loads(line) if line.lstrip().startswith('{') else {'position': line.strip()}
+            board = parse_position(record['position'], record.get('k', k))
+            if board.game_end():
+                raise ValueError('the game is over')
+        except (ValueError, KeyError, TypeError) as error:
+            return {'input': line.strip(), 'error': str(error) or repr(error)}, None
+        return record, (board, *self.submit(board))
+
+    def finish(self, record, work):
+        if work is None:
+            return record
+        board, key, symmetry, job, cached = work
+        try:
+            canonical_scores = self.canonical_scores(key, job)
+        except ValueError as error:
+            # e.g. an agent that cannot score positions on this board
+            record['error'] = str(error)
+            return record
+        permutation = board.geometry.symmetries[symmetry]
+        scores = {}
+        for index, (move_row, move_col) in enumerate(board.geometry.squares):
+            if permutation[index] in canonical_scores and not (board.bitboards[0] | board.bitboards[1]) >> index & 1:
+                scores['{0},{1}'.format(move_row, move_col)] = canonical_scores[permutation[index]]
+        best_score = max(scores.values())
+        record.update({
+            'position': format_position(board),
+            'to_move': 'xo'[board.active_player],
+            'scores': scores,
+            'best': [move for move, score in scores.items() if score == best_score],
+            'cached': cached,
+        })
+        return record
+
+    def close(self):
+        if self.pool is not None:
+            self.pool.shutdown()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Score every legal move of a stream of positions.')
+    parser.add_argument('input', nargs='?', help='file with one position per line (default: stdin)')
+    parser.add_argument('--agent', default='nstep', help='agent whose score_move is used, e.g. nstep:nsteps=4')
+    parser.add_argument('--k', type=int, default=3, help='pieces in a row needed to win, unless a line sets "k"')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes to score positions in')
+    parser.add_argument('--cache-size', type=int, default=2 ** 16, help='number of canonical positions to cache')
+    args = parser.parse_args(argv)
+
+    analyzer = Analyzer(args.agent, workers=args.workers, cache_size=args.cache_size)
+    input_file = open(args.input) if args.input else sys.stdin
+    try:
+        for record in analyzer.analyze(input_file, k=args.k):
+            sys.stdout.write(json.dumps(record) + '\n')
+    finally:
+        analyzer.close()
+        if args.input:
+            input_file.close()
+    print('cache hits {0}, misses {1}'.format(analyzer.hits, analyzer.misses), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
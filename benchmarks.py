@@ -0,0 +1,177 @@
+"""
+Benchmarks for the engine and agent hot paths
+
+Micro-benchmarks time GameBoard.game_end, get_legal_moves, place_piece, Agent.compute_heuristic,
+NStepAgent.score_move and NStepAgent.make_move on a fixed set of positions from the opening, the middle game and
+close to the end. Macro-benchmarks time the first move of a full-depth search, walk the game tree with perft, count
+self-play games per second and measure peak memory. Results are written as JSON; with --compare the run is checked
+against a saved baseline and the benchmarks that got slower than the threshold allows are flagged.
+
+Example:
+    python benchmarks.py --output baseline.json
+    python benchmarks.py --compare baseline.json --threshold 0.1
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import timeit
+import tracemalloc
+
+import tictactoe_engine as te
+import tictactoe_agents as ta
+import perft
+import tournament
+
+# the benchmark positions, as the moves leading to them; all of them are unfinished games
+POSITIONS = {
+    'opening': [],
+    'opening_center': [(1, 1)],
+    'midgame': [(1, 1), (0, 0), (2, 2), (0, 2)],
+    'midgame_threats': [(0, 0), (1, 1), (0, 1), (0, 2), (2, 0)],
+    'near_end': [(0, 0), (1, 1), (2, 2), (0, 1), (2, 1), (2, 0), (0, 2)],
+}
+
+
+def build_position(moves):
+    board = te.GameBoard()
+    for move_row, move_col in moves:
+        board.place_piece(row=move_row, col=move_col, player=board.active_player)
+    return board
+
+
+def time_call(function, repeat, number):
+    """the fastest time of a single call of function, over repeat runs of number calls"""
+    return min(timeit.Timer(function).repeat(repeat=repeat, number=number)) / number
+
+
+def result(value, unit, higher_is_better=False):
+    return {'value': value, 'unit': unit, 'higher_is_better': higher_is_better}
+
+
+def micro_benchmarks(repeat=5, scale=1.0):
+    """times the hot-path functions on every benchmark position; scale multiplies the number of calls per run"""
+    results = {}
+    for position_name, moves in POSITIONS.items():
+        board = build_position(moves)
+        player = board.active_player
+        move_row, move_col = board.get_legal_moves()[0]
+        number = max(1, int(10000 * scale))
+
+        def place_and_undo():
+            board.place_piece(row=move_row, col=move_col, player=player)
+            board.undo_move()
+
+        results['game_end/' + position_name] = result(time_call(board.game_end, repeat, number), 's')
+        results['get_legal_moves/' + position_name] = result(time_call(board.get_legal_moves, repeat, number), 's')
+        results['place_piece+undo_move/' + position_name] = result(time_call(place_and_undo, repeat, number), 's')
+        results['compute_heuristic/' + position_name] = result(
+            time_call(lambda: ta.Agent.compute_heuristic(board, player), repeat, number), 's')
+
+        # searches are timed without a transposition table so that repeated calls do the same work
+        search_agent = ta.NStepAgent(table_size=0)
+        search_number = max(1, int(scale * (2 if len(moves) < 2 else 20)))
+        results['score_move/' + position_name] = result(
+            time_call(lambda: search_agent.score_move((move_row, move_col), board), repeat, search_number), 's')
+
+        move_agent = ta.NStepAgent()
+        move_agent.announce_moves = False
+
+        def make_move():
+            move_agent.new_game()
+            move_agent.make_move(board)
+
+        results['make_move/' + position_name] = result(time_call(make_move, repeat, search_number), 's')
+    return results
+
+
+def macro_benchmarks(repeat=3, scale=1.0):
+    """times a full-depth first move, measures self-play speed and the peak memory of both"""
+    results = {}
+
+    def first_move():
+        agent = ta.NStepAgent(table_size=0)
+        agent.announce_moves = False
+        agent.make_move(te.GameBoard())
+
+    results['first_move_full_depth'] = result(time_call(first_move, repeat, 1), 's')
+
+    perft_depth = 9 if scale >= 1 else 6
+    perft_time = time_call(lambda: perft.perft(te.GameBoard(), perft_depth), repeat, 1)
+    leaves = perft.perft(te.GameBoard(), perft_depth).leaves
+    results['perft/depth_{0}'.format(perft_depth)] = result(leaves / perft_time, 'leaves/s', True)
+
+    for spec_1, spec_2, num_games in (('nstep', 'nstep', 20), ('onestep', 'random', 500)):
+        num_games = max(1, int(num_games * scale))
+        report = tournament.run_tournament(spec_1, spec_2, num_games)
+        results['self_play/{0}-{1}'.format(spec_1, spec_2)] = result(report['games_per_second'], 'games/s', True)
+
+    tracemalloc.start()
+    first_move()
+    results['peak_memory/first_move_full_depth'] = result(tracemalloc.get_traced_memory()[1], 'bytes')
+    tracemalloc.reset_peak()
+    tournament.run_tournament('nstep', 'nstep', max(1, int(10 * scale)))
+    results['peak_memory/self_play'] = result(tracemalloc.get_traced_memory()[1], 'bytes')
+    tracemalloc.stop()
+    return results
+
+
+def run_benchmarks(scale=1.0):
+    random.seed(0)
+    return {
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'benchmarks': {**micro_benchmarks(scale=scale), **macro_benchmarks(scale=scale)},
+    }
+
+
+def compare(current, baseline, threshold=0.1):
+    """
+    returns (name, baseline value, current value, relative change) for every benchmark that got worse by more than
+    threshold, where the change is positive for a slowdown whichever way the benchmark is measured
+    """
+    regressions = []
+    for name, current_result in current['benchmarks'].items():
+        baseline_result = baseline['benchmarks'].get(name)
+        if baseline_result is None or baseline_result['value'] <= 0 or current_result['value'] <= 0:
+            continue
+        if current_result['higher_is_better']:
+            change = baseline_result['value'] / current_result['value'] - 1
+        else:
+            change = current_result['value'] / baseline_result['value'] - 1
+        if change > threshold:
+            regressions.append((name, baseline_result['value'], current_result['value'], change))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark the tic-tac-toe engine and agents.')
+    parser.add_argument('--output', help='file to write the results to as JSON (default: print them)')
+    parser.add_argument('--compare', help='baseline JSON file to compare the results against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative slowdown above which a benchmark is flagged (default 0.1, i.e. 10%%)')
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplies the amount of work per benchmark')
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(scale=args.scale)
+    if args.output:
+        with open(args.output, 'w') as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        print(json.dumps(results, indent=2))
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare(results, baseline, args.threshold)
+        for name, baseline_value, current_value, change in regressions:
+            print('SLOWER {0}: {1:.6g} -> {2:.6g} ({3:+.0%})'.format(name, baseline_value, current_value, change))
+        if regressions:
+            sys.exit(1)
+        print('no benchmark got more than {0:.0%} slower'.format(args.threshold))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,454 @@
+"""
+An asyncio server that hosts many games at once over TCP
+
+Clients send one JSON object per line and receive one JSON object per line. A client can play any number of games
+on one connection; every game is against a computer player described like the agents of tournament.py.
+The computer's moves are computed in a bounded pool of processes, so a slow search never blocks the server.
+
+Requests:
+    {"op": "new", "opponent": "nstep", "first": true, "rows": 3, "cols": 3, "k": 3}
+        starts a game; the client moves first unless "first" is false. Every key but "op" is optional; rows and cols
+        can be at most 10, or the server's --max-board-side. The opponent is random, onestep, nstep or mcts, with
+        only the options listed in OPPONENT_OPTIONS, e.g. "nstep:nsteps=2,move_radius=1" or "mcts:playouts=500"
+    {"op": "move", "game": 1, "row": 0, "col": 2}
+        plays a move for the client in the given game
+    {"op": "stats"}
+        reports the server metrics
+Replies and events carry an "event" key: "started", "moved" (for both players), "ended", "stats" or "error".
+A request can carry an "id", which is copied into its replies.
+
+Backpressure: a connection has at most max_in_flight requests being handled; the server stops reading from it until
+one of them is done, so a fast client is slowed down by TCP. When max_queue computer moves are already waiting for
+the pool, further moves are refused with a "busy" error instead of queueing without bound.
+
+Example:
+    python game_server.py serve --port 8765 --workers 4
+    python game_server.py load --port 8765 --games 1000 --opponent nstep:nsteps=2
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import tictactoe_engine as te
+import tictactoe_agents as ta
+import tournament
+
+DEFAULT_PORT = 8765
+MAX_BOARD_SIDE = 10  # the longest board side a client can ask for; bigger boards take seconds to set up
+LATENCY_WINDOW = 10000  # the number of most recent computer moves the latency percentiles are computed over
+MAX_POOL_AGENTS = 32  # the number of agents a pool process keeps; the least recently used one is dropped first
+
+# the agents clients can play against and, for each, the options they may set with the values allowed for them.
+# Anything else could make the server read or write files, start processes or search without end.
+OPPONENT_OPTIONS = {
+    'random': {},
+    'onestep': {},
+    'nstep': {'nsteps': range(1, 10), 'time_limit_ms': range(1, 10001), 'move_radius': range(1, MAX_BOARD_SIDE + 1),
+              'ordering': ta.NStepAgent.ORDERINGS, 'search': ta.NStepAgent.SEARCHES},
+    'mcts': {'playouts': range(1, 100001), 'time_limit_ms': range(1, 10001)},
+}
+
+_pool_agents = collections.OrderedDict()  # agent description -> the agent a pool process plays with, oldest first
+
+
+def compute_move(spec, rows, cols, k, moves):
+    """the move of the agent described by spec on the position reached by moves; runs in a pool process"""
+    agent = _pool_agents.get(spec)
+    if agent is None:
+        agent = tournament.build_agent(spec)
+        _pool_agents[spec] = agent
+        if len(_pool_agents) > MAX_POOL_AGENTS:
+            _, dropped = _pool_agents.popitem(last=False)
+            close = getattr(dropped, 'close', None)
+            if close is not None:
+                close()
+    else:
+        _pool_agents.move_to_end(spec)
+
+    board = te.GameBoard(rows=rows, cols=cols, k=k)
+    for move_row, move_col, player in moves:
+        board.place_piece(row=move_row, col=move_col, player=player)
+    # the positions a process is sent come from unrelated games, so no state is carried over between them
+    agent.new_game()
+    return agent.make_move(board)
+
+
+class ServerError(Exception):
+    """a request that cannot be carried out; the message is sent back to the client"""
+
+
+def int_field(request, name, default=None, low=None, high=None):
+    """the integer request[name], or default if it is missing; raises a ServerError if it is not an integer in range"""
+    value = request.get(name, default)
+    if not isinstance(value, int) or isinstance(value, bool):
+        raise ServerError('{0} must be an integer'.format(name))
+    if (low is not None and value < low) or (high is not None and value > high):
+        raise ServerError('{0} must be between {1} and {2}'.format(name, low, high))
+    return value
+
+
+def opponent_spec(opponent):
+    """
+    the agent description opponent in a canonical form, with its options sorted; raises a ServerError unless it
+    describes one of OPPONENT_OPTIONS with allowed options only
+    """
+    if opponent.partition(':')[0] not in OPPONENT_OPTIONS:
+        raise ServerError('opponent must be one of {0}'.format(', '.join(OPPONENT_OPTIONS)))
+    try:
+        agent_type, kwargs = tournament.parse_agent_spec(opponent)
+    except ValueError as error:
+        raise ServerError(str(error))
+
+    allowed = OPPONENT_OPTIONS[agent_type]
+    for name, value in kwargs.items():
+        if name not in allowed:
+            raise ServerError('{0} does not take the option {1}'.format(agent_type, name))
+        values = allowed[name]
+        if isinstance(values, range):
+            if not isinstance(value, int) or isinstance(value, bool) or value not in values:
+                raise ServerError('{0} must be an integer between {1} and {2}'.format(name, values[0], values[-1]))
+        elif value not in values:
+            raise ServerError('{0} must be one of {1}'.format(name, ', '.join(values)))
+    if not kwargs:
+        return agent_type
+    return agent_type + ':' + ','.join('{0}={1!r}'.format(name, kwargs[name]) for name in sorted(kwargs))
+
+
+class Game:
+    """a game between a client and a computer player"""
+
+    def __init__(self, game_id, opponent, client_player, rows, cols, k):
+        self.game_id = game_id
+        self.opponent = opponent
+        self.client_player = client_player
+        self.board = te.GameBoard(rows=rows, cols=cols, k=k)
+        self.lock = asyncio.Lock()  # moves for one game are handled one at a time
+
+    def result(self):
+        """'win', 'loss' or 'draw' for the client"""
+        if self.board.winner == -1:
+            return 'draw'
+        return 'win' if self.board.winner == self.client_player else 'loss'
+
+
+class GameServer:
+    """
+    Hosts the games of all connections. max_games bounds the number of unfinished games, max_queue the number of
+    computer moves waiting for or running in the pool of workers processes, max_in_flight the number of requests
+    of one connection that are handled at the same time and max_board_side the number of rows and columns of a game.
+    """
+
+    def __init__(self, workers=None, max_games=10000, max_queue=256, max_in_flight=64, max_board_side=MAX_BOARD_SIDE):
+        self.pool = ProcessPoolExecutor(max_workers=workers)
+        self.max_games = max_games
+        self.max_queue = max_queue
+        self.max_in_flight = max_in_flight
+        self.max_board_side = max_board_side
+        self.games = {}
+        self._next_game_id = 1
+
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.games_started = 0
+        self.games_finished = 0
+        self.moves_refused = 0
+        self.connections = 0
+        self.latencies = collections.deque(maxlen=LATENCY_WINDOW)
+
+    def metrics(self):
+        latencies = list(self.latencies)
+        return {
+            'connections': self.connections,
+            'active_games': len(self.games),
+            'games_started': self.games_started,
+            'games_finished': self.games_finished,
+            'queue_depth': self.queue_depth,
+            'max_queue_depth': self.max_queue_depth,
+            'moves_refused': self.moves_refused,
+            'computer_moves': len(latencies),
+            'move_latency_ms': {'p{0}'.format(q): 1000 * tournament.percentile(latencies, q)
+                                for q in tournament.LATENCY_PERCENTILES},
+        }
+
+    async def computer_move(self, game):
+        """computes and plays the move of the computer player in game, in the process pool"""
+        board = game.board
+        self.queue_depth += 1
+        self.max_queue_depth = max(self.max_queue_depth, self.queue_depth)
+        start = time.perf_counter()
+        try:
+            move_row, move_col = await asyncio.get_running_loop().run_in_executor(
+                self.pool, compute_move, game.opponent, board.rows, board.cols, board.k, list(board.moves))
+        except Exception as error:
+            # e.g. an agent that cannot play on this board; the game cannot go on
+            self.games.pop(game.game_id, None)
+            raise ServerError('the computer player failed: {0!r}'.format(error))
+        finally:
+            self.queue_depth -= 1
+        self.latencies.append(time.perf_counter() - start)
+
+        player = board.active_player
+        board.place_piece(row=move_row, col=move_col, player=player)
+        return {'event': 'moved', 'game': game.game_id, 'row': move_row, 'col': move_col, 'player': player}
+
+    def check_queue(self):
+        """
+        refuses a request when the pool is too far behind. Called before a request changes anything, so that a
+        refused request can simply be sent again later
+        """
+        if self.queue_depth >= self.max_queue:
+            self.moves_refused += 1
+            raise ServerError('busy')
+
+    async def play_computer_moves(self, game):
+        """the events of the computer's move, if it is to move, and of the end of the game, if it ended"""
+        events = []
+        if not game.board.game_end() and game.board.active_player != game.client_player:
+            events.append(await self.computer_move(game))
+        if game.board.game_end():
+            del self.games[game.game_id]
+            self.games_finished += 1
+            events.append({'event': 'ended', 'game': game.game_id, 'winner': game.board.winner,
+                           'result': game.result()})
+        return events
+
+    async def new_game(self, request):
+        if len(self.games) >= self.max_games:
+            raise ServerError('too many games')
+        self.check_queue()
+        opponent = request.get('opponent', 'nstep')
+        if not isinstance(opponent, str):
+            raise ServerError('opponent must be a string')
+        opponent = opponent_spec(opponent)
+        rows = int_field(request, 'rows', 3, 1, self.max_board_side)
+        cols = int_field(request, 'cols', 3, 1, self.max_board_side)
+        k = int_field(request, 'k', 3, 1, max(rows, cols))
+        try:
+            # the tables of a new board size take a while to build, so that happens outside the event loop
+            await asyncio.get_running_loop().run_in_executor(None, te.get_geometry, rows, cols, k)
+            game = Game(self._next_game_id, opponent, 0 if request.get('first', True) else 1, rows, cols, k)
+        except (TypeError, ValueError) as error:
+            raise ServerError(str(error))
+
+        self._next_game_id += 1
+        self.games[game.game_id] = game
+        self.games_started += 1
+        started = {'event': 'started', 'game': game.game_id, 'player': game.client_player,
+                   'rows': game.board.rows, 'cols': game.board.cols, 'k': game.board.k}
+        async with game.lock:
+            return [started] + await self.play_computer_moves(game)
+
+    async def move(self, request):
+        game = self.games.get(int_field(request, 'game'))
+        if game is None:
+            raise ServerError('unknown or finished game')
+
+        async with game.lock:
+            board = game.board
+            if board.game_end() or board.active_player != game.client_player:
+                raise ServerError('it is not your move')
+            move = (int_field(request, 'row'), int_field(request, 'col'))
+            if move not in board.get_legal_moves():
+                raise ServerError('illegal move')
+            self.check_queue()
+
+            board.place_piece(row=move[0], col=move[1], player=game.client_player)
+            moved = {'event': 'moved', 'game': game.game_id, 'row': move[0], 'col': move[1],
+                     'player': game.client_player}
+            return [moved] + await self.play_computer_moves(game)
+
+    async def handle_request(self, line):
+        """the events replying to one request line"""
+        try:
+            request = json.loads(line)
+            if not isinstance(request, dict):
+                raise ValueError
+        except ValueError:
+            return [{'event': 'error', 'reason': 'requests must be JSON objects'}]
+
+        op = request.get('op')
+        try:
+            if op == 'new':
+                events = await self.new_game(request)
+            elif op == 'move':
+                events = await self.move(request)
+            elif op == 'stats':
+                events = [{'event': 'stats', **self.metrics()}]
+            else:
+                raise ServerError('unknown op {0}'.format(op))
+        except ServerError as error:
+            events = [{'event': 'error', 'reason': str(error)}]
+            if 'game' in request:
+                events[0]['game'] = request['game']
+        except Exception as error:
+            # a bug should cost the client this request, not leave it waiting for a reply forever
+            events = [{'event': 'error', 'reason': 'internal error: {0!r}'.format(error)}]
+
+        if 'id' in request:
+            for event in events:
+                event['id'] = request['id']
+        return events
+
+    async def handle_connection(self, reader, writer):
+        self.connections += 1
+        in_flight = asyncio.Semaphore(self.max_in_flight)
+        tasks = set()
+
+        async def respond(line):
+            try:
+                events = await self.handle_request(line)
+                writer.write(''.join(json.dumps(event) + '\n' for event in events).encode())
+                await writer.drain()
+            except ConnectionError:
+                pass
+            finally:
+                in_flight.release()
+
+        try:
+            while True:
+                # waiting here before reading is what pushes back on a client that sends faster than it is served
+                await in_flight.acquire()
+                line = await reader.readline()
+                if not line:
+                    in_flight.release()
+                    break
+                task = asyncio.create_task(respond(line))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+            if tasks:
+                await asyncio.gather(*tasks)
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT, stats_interval=None):
+        server = await asyncio.start_server(self.handle_connection, host, port, limit=2 ** 16)
+        print('serving on {0}'.format(', '.join(str(sock.getsockname()) for sock in server.sockets)))
+        async with server:
+            if stats_interval:
+                asyncio.create_task(self.report_metrics(stats_interval))
+            await server.serve_forever()
+
+    async def report_metrics(self, interval):
+        while True:
+            await asyncio.sleep(interval)
+            print(json.dumps(self.metrics()))
+
+    def close(self):
+        self.pool.shutdown(cancel_futures=True)
+
+
+async def play_random_client(reader, writer, game_ids, opponent, rows, cols, k):
+    """plays games with random moves on one connection until all of them have ended; returns the results"""
+    results = []
+    boards = {}
+    requests = {}  # request id -> the request, until it has been answered
+    lock = asyncio.Lock()
+
+    async def send(request, delay=0.0):
+        await asyncio.sleep(delay)
+        async with lock:
+            writer.write((json.dumps(request) + '\n').encode())
+            await writer.drain()
+
+    for index in game_ids:
+        requests[index] = {'op': 'new', 'opponent': opponent, 'first': index % 2 == 0, 'rows': rows, 'cols': cols,
+                           'k': k, 'id': index}
+        await send(requests[index])
+
+    unfinished = len(game_ids)
+    next_id = max(game_ids, default=0) + 1
+    while unfinished:
+        event = json.loads(await reader.readline())
+        if event['event'] == 'error' and event['reason'] == 'busy':
+            asyncio.create_task(send(requests[event['id']], delay=0.01))
+            continue
+        requests.pop(event.get('id'), None)
+        if event['event'] == 'started':
+            boards[event['game']] = (te.GameBoard(rows=rows, cols=cols, k=k), event['player'])
+        elif event['event'] == 'moved':
+            board, _ = boards[event['game']]
+            board.place_piece(row=event['row'], col=event['col'], player=event['player'])
+        elif event['event'] == 'ended':
+            results.append(event['result'])
+            del boards[event['game']]
+            unfinished -= 1
+            continue
+        elif event['event'] == 'error':
+            raise RuntimeError('the server refused a request: {0}'.format(event['reason']))
+
+        board, player = boards[event['game']]
+        if not board.game_end() and board.active_player == player:
+            move_row, move_col = random.choice(board.get_legal_moves())
+            requests[next_id] = {'op': 'move', 'game': event['game'], 'row': move_row, 'col': move_col, 'id': next_id}
+            await send(requests[next_id])
+            next_id += 1
+    return results
+
+
+async def load_test(host, port, num_games, connections=10, opponent='nstep', rows=3, cols=3, k=3):
+    """plays num_games games with random moves against the server over several connections and reports the results"""
+    start = time.perf_counter()
+    streams = [await asyncio.open_connection(host, port) for _ in range(0, connections)]
+    client_results = await asyncio.gather(*(
+        play_random_client(reader, writer, range(index, num_games, connections), opponent, rows, cols, k)
+        for index, (reader, writer) in enumerate(streams)))
+    elapsed = time.perf_counter() - start
+
+    reader, writer = streams[0]
+    writer.write(b'{"op": "stats"}\n')
+    await writer.drain()
+    metrics = json.loads(await reader.readline())
+    for _, writer in streams:
+        writer.close()
+
+    results = [result for one_client in client_results for result in one_client]
+    return {
+        'games': num_games,
+        'client_results': {name: results.count(name) for name in ('win', 'draw', 'loss')},
+        'seconds': elapsed,
+        'games_per_second': num_games / elapsed if elapsed > 0 else float('inf'),
+        'server': metrics,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Host tic-tac-toe games over TCP, or load test such a server.')
+    parser.add_argument('mode', choices=['serve', 'load'])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--workers', type=int, default=None, help='number of processes computing computer moves')
+    parser.add_argument('--max-games', type=int, default=10000, help='maximum number of unfinished games')
+    parser.add_argument('--max-queue', type=int, default=256, help='maximum number of queued computer moves')
+    parser.add_argument('--max-board-side', type=int, default=MAX_BOARD_SIDE, help='maximum number of rows or cols')
+    parser.add_argument('--stats-interval', type=float, default=None, help='seconds between printed metrics')
+    parser.add_argument('--games', type=int, default=100, help='load: number of games to play')
+    parser.add_argument('--connections', type=int, default=10, help='load: number of connections to play them on')
+    parser.add_argument('--opponent', default='nstep', help='load: computer player, e.g. nstep:nsteps=2')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3)
+    args = parser.parse_args(argv)
+
+    if args.mode == 'serve':
+        server = GameServer(workers=args.workers, max_games=args.max_games, max_queue=args.max_queue,
+                            max_board_side=args.max_board_side)
+        try:
+            asyncio.run(server.serve(args.host, args.port, args.stats_interval))
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.close()
+    else:
+        report = asyncio.run(load_test(args.host, args.port, args.games, args.connections, args.opponent,
+                                       args.rows, args.cols, args.k))
+        print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
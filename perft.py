@@ -0,0 +1,174 @@
+"""
+Perft: walks the complete game tree from a position to check and time the move generator
+
+Every position up to the given depth is visited with GameBoard.get_legal_moves, place_piece, undo_move and
+game_end, without any evaluation. For every ply the number of positions reached and the number of games won by X,
+won by O and drawn at that ply are counted. From the empty 3x3 board these counts are known exactly (255,168 games
+in total); a run from there is checked against them, so a change to the engine that breaks the rules shows up as a
+mismatch. Divide mode gives the counts below every root move separately, to narrow down where two versions differ.
+
+Example:
+    python perft.py
+    python perft.py --moves 1,1 0,0 --divide
+    python perft.py --rows 4 --cols 4 --k 3 --depth 5
+"""
+
+import argparse
+import sys
+import time
+
+import tictactoe_engine as te
+
+# per ply from the empty 3x3 board: (positions, X wins, O wins, draws)
+KNOWN_COUNTS = {
+    (3, 3, 3): (
+        (1, 0, 0, 0),
+        (9, 0, 0, 0),
+        (72, 0, 0, 0),
+        (504, 0, 0, 0),
+        (3024, 0, 0, 0),
+        (15120, 1440, 0, 0),
+        (54720, 0, 5328, 0),
+        (148176, 47952, 0, 0),
+        (200448, 0, 72576, 0),
+        (127872, 81792, 0, 46080),
+    ),
+}
+
+
+class PerftCounts:
+    """the counts of a perft run: per ply positions, X wins, O wins and draws, and the number of leaves"""
+
+    def __init__(self, depth):
+        self.positions = [0] * (depth + 1)
+        self.x_wins = [0] * (depth + 1)
+        self.o_wins = [0] * (depth + 1)
+        self.draws = [0] * (depth + 1)
+        self.leaves = 0  # finished games plus unfinished positions at the maximum depth
+
+    @property
+    def games(self):
+        return sum(self.x_wins) + sum(self.o_wins) + sum(self.draws)
+
+    def rows(self):
+        return list(zip(self.positions, self.x_wins, self.o_wins, self.draws))
+
+
+def perft(board, depth):
+    """walks all move sequences of up to depth moves from the position on board and returns the PerftCounts"""
+    counts = PerftCounts(depth)
+    positions, x_wins, o_wins, draws = counts.positions, counts.x_wins, counts.o_wins, counts.draws
+    results = (x_wins, o_wins)
+
+    def walk(ply):
+        positions[ply] += 1
+        if board.game_end():
+            if board.winner == -1:
+                draws[ply] += 1
+            else:
+                results[board.winner][ply] += 1
+            counts.leaves += 1
+            return
+        if ply == depth:
+            counts.leaves += 1
+            return
+        for move_row, move_col in board.get_legal_moves():
+            board.place_piece(row=move_row, col=move_col, player=board.active_player)
+            walk(ply + 1)
+            board.undo_move()
+
+    walk(0)
+    return counts
+
+
+def divide(board, depth):
+    """the PerftCounts below every legal move on board, searched to depth - 1 more moves, by move"""
+    results = {}
+    for move_row, move_col in board.get_legal_moves():
+        board.place_piece(row=move_row, col=move_col, player=board.active_player)
+        results[(move_row, move_col)] = perft(board, depth - 1)
+        board.undo_move()
+    return results
+
+
+def check_counts(board, counts):
+    """
+    compares counts with the known counts for the position on board, if there are any, and returns a list of
+    (ply, expected, found) for the plies that differ; None means there are no known counts to compare with
+    """
+    known = KNOWN_COUNTS.get((board.rows, board.cols, board.k))
+    if known is None or board.moves:
+        return None
+    return [(ply, expected, found) for ply, (expected, found) in enumerate(zip(known, counts.rows()))
+            if expected != found]
+
+
+def build_board(rows, cols, k, moves):
+    board = te.GameBoard(rows=rows, cols=cols, k=k)
+    for move_row, move_col in moves:
+        if (move_row, move_col) not in board.get_legal_moves() or board.game_end():
+            raise ValueError('illegal move {0},{1}'.format(move_row, move_col))
+        board.place_piece(row=move_row, col=move_col, player=board.active_player)
+    return board
+
+
+def parse_move(text):
+    row, col = text.split(',')
+    return int(row), int(col)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Count the game tree from a position to check the move generator.')
+    parser.add_argument('--moves', nargs='*', type=parse_move, default=[],
+                        help='moves leading to the start position as row,col counting from 0, e.g. 1,1 0,0')
+    parser.add_argument('--depth', type=int, default=None, help='number of moves to look ahead (default: all)')
+    parser.add_argument('--divide', action='store_true', help='show the counts below every root move')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3, help='number of pieces in a row needed to win')
+    args = parser.parse_args(argv)
+    if args.depth is not None and args.depth < 0:
+        parser.error('--depth must not be negative')
+    if args.depth == 0 and args.divide:
+        parser.error('--depth must be at least 1 with --divide')
+
+    board = build_board(args.rows, args.cols, args.k, args.moves)
+    depth = args.depth if args.depth is not None else board.num_squares - len(board.moves)
+
+    if args.divide:
+        start = time.perf_counter()
+        results = divide(board, depth)
+        elapsed = time.perf_counter() - start
+        for (move_row, move_col), counts in results.items():
+            print('{0},{1}: {2} leaves, {3} games, X wins {4}, O wins {5}, draws {6}'.format(
+                move_row, move_col, counts.leaves, counts.games, sum(counts.x_wins), sum(counts.o_wins),
+                sum(counts.draws)))
+        leaves = sum(counts.leaves for counts in results.values())
+        print('{0} moves, {1} leaves in {2:.2f} s, {3:,.0f} leaves per second'.format(
+            len(results), leaves, elapsed, leaves / elapsed if elapsed > 0 else float('inf')))
+        return
+
+    start = time.perf_counter()
+    counts = perft(board, depth)
+    elapsed = time.perf_counter() - start
+
+    print('{0:>5} {1:>12} {2:>10} {3:>10} {4:>10}'.format('ply', 'positions', 'X wins', 'O wins', 'draws'))
+    for ply, row in enumerate(counts.rows()):
+        print('{0:>5} {1:>12} {2:>10} {3:>10} {4:>10}'.format(ply + len(board.moves), *row))
+    print('{0} games: X wins {1}, O wins {2}, draws {3}'.format(counts.games, sum(counts.x_wins),
+                                                                sum(counts.o_wins), sum(counts.draws)))
+    print('{0} leaves in {1:.2f} s, {2:,.0f} leaves per second'.format(
+        counts.leaves, elapsed, counts.leaves / elapsed if elapsed > 0 else float('inf')))
+
+    mismatches = check_counts(board, counts)
+    if mismatches is None:
+        return
+    for ply, expected, found in mismatches:
+        print('MISMATCH at ply {0}: expected {1}, found {2}'.format(ply, expected, found))
+    if mismatches:
+        sys.exit(1)
+    print('all counts match the known values')
+
+
+if __name__ == '__main__':
+    main()
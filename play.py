@@ -1,5 +1,6 @@
 import tictactoe_engine as te
 import tictactoe_agents as ta
+import tictactoe_protocol as tp
 
 
 def select_agent(input_player):
@@ -14,7 +15,9 @@ def select_agent(input_player):
                               '2: Easy Computer\n'
                               '3: Medium Computer\n'
                               '4: Hard Computer\n'
-                              '5: Hard Computer with move explanation\n')
+                              '5: Hard Computer with move explanation\n'
+                              '6: Perfect Computer\n'
+                              '7: Hard Computer in a separate engine process\n')
         incorrect_choice = False
         player = 0
 
@@ -34,6 +37,10 @@ def select_agent(input_player):
             player_agent = ta.NStepAgent('Hard Computer')
         elif player == 5:
             player_agent = ta.NStepAgent('Hard Computer', verbose=True)
+        elif player == 6:
+            player_agent = ta.TablebaseAgent('Perfect Computer')
+        elif player == 7:
+            player_agent = tp.RemoteAgent('Hard Computer', spec='nstep')
         else:
             incorrect_choice = True
             print('I don\'t understand your choice, please try again')
@@ -0,0 +1,185 @@
+"""
+Sequential probability ratio test (SPRT) matches between two agents
+
+Instead of playing a fixed number of games, the match is played in batches and stops as soon as the results are
+strong enough evidence either that agent 1 is at least elo1 Elo stronger than agent 2 (H1) or that it is at most elo0
+Elo stronger (H0), with error rates alpha (accepting H1 while H0 holds) and beta (accepting H0 while H1 holds).
+Clear differences are decided after a few dozen games; only close calls need many.
+
+The test uses the log-likelihood ratio of the trinomial (win/draw/loss) model as approximated by a normal
+distribution of the score per game, as chess engine testing frameworks do:
+    LLR = N (s1 - s0) (2 x - s0 - s1) / (2 var)
+where N is the number of games, x the mean score, var its variance per game and s0, s1 the expected scores at
+elo0 and elo1. The match stops once LLR leaves the interval (log(beta / (1 - alpha)), log((1 - beta) / alpha)).
+
+Example:
+    python sprt.py nstep nstep:nsteps=1 --elo0 0 --elo1 50 --workers 4
+"""
+
+import argparse
+import math
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import tournament
+
+# two-sided normal quantiles for the confidence interval of the Elo estimate
+Z_SCORES = {0.9: 1.6449, 0.95: 1.9600, 0.99: 2.5758}
+
+
+def expected_score(elo):
+    """the expected score per game of a player elo Elo stronger than its opponent"""
+    return 1 / (1 + 10 ** (-elo / 400))
+
+
+def elo_from_score(score):
+    """the Elo difference at which score is the expected score; infinite for a score of 0 or 1"""
+    if score <= 0:
+        return -math.inf
+    if score >= 1:
+        return math.inf
+    return 400 * math.log10(score / (1 - score))
+
+
+def score_statistics(wins, draws, losses):
+    """
+    the mean score per game and its variance. The variance is computed with half a game of each result added, so
+    that it is not 0 when all games ended the same way
+    """
+    games = wins + draws + losses
+    mean = (wins + draws / 2) / games
+    regularized = [(count + 0.5, score) for count, score in ((wins, 1.0), (draws, 0.5), (losses, 0.0))]
+    total = sum(count for count, _ in regularized)
+    regularized_mean = sum(count * score for count, score in regularized) / total
+    variance = sum(count * (score - regularized_mean) ** 2 for count, score in regularized) / total
+    return mean, variance
+
+
+def log_likelihood_ratio(wins, draws, losses, elo0, elo1):
+    """the LLR of H1 (Elo difference elo1) against H0 (elo0) given the results so far"""
+    games = wins + draws + losses
+    if games == 0:
+        return 0.0
+    mean, variance = score_statistics(wins, draws, losses)
+    s0 = expected_score(elo0)
+    s1 = expected_score(elo1)
+    return games * (s1 - s0) * (2 * mean - s0 - s1) / (2 * variance)
+
+
+def sprt_bounds(alpha, beta):
+    """(lower, upper): the LLR at or below which H0 is accepted and at or above which H1 is accepted"""
+    return math.log(beta / (1 - alpha)), math.log((1 - beta) / alpha)
+
+
+def elo_estimate(wins, draws, losses, confidence=0.95):
+    """(Elo difference, lower bound, upper bound) of the confidence interval, from agent 1's results"""
+    games = wins + draws + losses
+    mean, variance = score_statistics(wins, draws, losses)
+    margin = Z_SCORES[confidence] * math.sqrt(variance / games)
+    return elo_from_score(mean), elo_from_score(mean - margin), elo_from_score(mean + margin)
+
+
+def run_sprt(spec_1, spec_2, elo0=0.0, elo1=50.0, alpha=0.05, beta=0.05, batch_size=20, max_games=10000,
+             workers=None, seed=0, rows=3, cols=3, k=3, confidence=0.95, progress=None):
+    """
+    plays batches of batch_size games between the agents described by spec_1 and spec_2 until the SPRT decides or
+    max_games have been played, and returns a report dict. The decision is 'H1' (agent 1 is at least elo1 stronger),
+    'H0' (at most elo0) or None. progress, if given, is called with the report after every batch.
+    All batches are played by one pool of workers processes, each building the agents once for the whole match.
+    """
+    if not elo0 < elo1:
+        raise ValueError('elo0 must be smaller than elo1')
+    # an even batch size gives both agents the first move equally often in every batch
+    batch_size = max(2, batch_size + batch_size % 2)
+    lower, upper = sprt_bounds(alpha, beta)
+    wins = draws = losses = 0
+    start = time.perf_counter()
+    report = None
+    pool = ProcessPoolExecutor(max_workers=workers) if workers is not None and workers > 1 else None
+
+    try:
+        while wins + draws + losses < max_games:
+            num_games = min(batch_size, max_games - wins - draws - losses)
+            batch = tournament.run_tournament(spec_1, spec_2, num_games, workers=workers, seed=seed, rows=rows,
+                                              cols=cols, k=k, first_game=wins + draws + losses, pool=pool,
+                                              keep_agents=True)
+            wins += batch['wins']
+            draws += batch['draws']
+            losses += batch['losses']
+
+            llr = log_likelihood_ratio(wins, draws, losses, elo0, elo1)
+            decision = 'H1' if llr >= upper else 'H0' if llr <= lower else None
+            elo, elo_low, elo_high = elo_estimate(wins, draws, losses, confidence)
+            report = {
+                'agents': [spec_1, spec_2],
+                'games': wins + draws + losses,
+                'wins': wins,
+                'draws': draws,
+                'losses': losses,
+                'llr': llr,
+                'bounds': [lower, upper],
+                'hypotheses': {'elo0': elo0, 'elo1': elo1, 'alpha': alpha, 'beta': beta},
+                'decision': decision,
+                'elo': elo,
+                'elo_interval': [elo_low, elo_high],
+                'confidence': confidence,
+                'seconds': time.perf_counter() - start,
+            }
+            if progress is not None:
+                progress(report)
+            if decision is not None:
+                break
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return report
+
+
+def print_report(report):
+    hypotheses = report['hypotheses']
+    print('{0} vs {1}: {2} games, wins {3}, draws {4}, losses {5}'.format(
+        report['agents'][0], report['agents'][1], report['games'], report['wins'], report['draws'],
+        report['losses']))
+    print('LLR {0:.2f} (bounds {1:.2f}, {2:.2f})'.format(report['llr'], *report['bounds']))
+    print('Elo {0:+.1f}, {1:.0%} confidence interval [{2:+.1f}, {3:+.1f}]'.format(
+        report['elo'], report['confidence'], *report['elo_interval']))
+    if report['decision'] == 'H1':
+        print('H1 accepted: {0} is at least {1:g} Elo stronger'.format(report['agents'][0], hypotheses['elo1']))
+    elif report['decision'] == 'H0':
+        print('H0 accepted: {0} is at most {1:g} Elo stronger'.format(report['agents'][0], hypotheses['elo0']))
+    else:
+        print('no decision after the maximum number of games')
+    print('{0:.1f} s'.format(report['seconds']))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play a match between two agents until an SPRT decides.')
+    parser.add_argument('agent_1', help='first agent, e.g. nstep:nsteps=4')
+    parser.add_argument('agent_2', help='second agent, in the same format')
+    parser.add_argument('--elo0', type=float, default=0.0, help='Elo difference under H0 (default 0)')
+    parser.add_argument('--elo1', type=float, default=50.0, help='Elo difference under H1 (default 50)')
+    parser.add_argument('--alpha', type=float, default=0.05, help='chance of accepting H1 when H0 holds')
+    parser.add_argument('--beta', type=float, default=0.05, help='chance of accepting H0 when H1 holds')
+    parser.add_argument('--batch', type=int, default=20, help='games per batch')
+    parser.add_argument('--max-games', type=int, default=10000)
+    parser.add_argument('--workers', type=int, default=None, help='number of processes to play each batch in')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3, help='number of pieces in a row needed to win')
+    parser.add_argument('--confidence', type=float, choices=sorted(Z_SCORES), default=0.95)
+    parser.add_argument('--verbose', action='store_true', help='print the LLR after every batch')
+    args = parser.parse_args(argv)
+
+    def progress(report):
+        print('{0} games: +{1} ={2} -{3}, LLR {4:.2f}'.format(report['games'], report['wins'], report['draws'],
+                                                              report['losses'], report['llr']))
+
+    report = run_sprt(args.agent_1, args.agent_2, args.elo0, args.elo1, args.alpha, args.beta, args.batch,
+                      args.max_games, args.workers, args.seed, args.rows, args.cols, args.k, args.confidence,
+                      progress if args.verbose else None)
+    print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,23 +3,49 @@ This is a testing ground to develop agents for tic tac toe
 """
 
 import tictactoe_engine as te
-import copy
+import tictactoe_tablebase as tb
+import tictactoe_learning as tl
+import tictactoe_cache as tc
 import random
 import math
+import time
+import cProfile
+import tracemalloc
+import multiprocessing
+from array import array
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import tictactoe_vectorized as tv
+except ImportError:  # numpy is not installed, so the agents score one board at a time
+    tv = None
 
 
 class Agent:
     """Base class for agents that play tic tac toe"""
     def __init__(self, name=''):
         self.name = name
+        self.announce_moves = True  # set to False to play without printing every move
+
+    def new_game(self):
+        """
+        called by TicTacToe before the first move of every game; agents that keep state between moves reset it here
+        """
+        pass
+
+    def announce_move(self, move):
+        """prints the move this agent made, unless announce_moves has been switched off"""
+        if self.announce_moves:
+            print("{0} made the move ({1})\n".format(self.name, ', '.join([str(comp + 1) for comp in move])))
 
     def score_move(self, move, board):
         """computes the score of a move on a board; uses compute_heuristic"""
         player = board.active_player
-        temp_board = copy.deepcopy(board)
         move_row, move_col = move
-        temp_board.place_piece(row=move_row, col=move_col, player=player)
-        final_score = self.compute_heuristic(temp_board, player)
+        board.place_piece(row=move_row, col=move_col, player=player)
+        final_score = self.compute_heuristic(board, player)
+        board.undo_move()
         # print('Final score of move ({0}) is: {1}'.format(', '.join([str(comp + 1) for comp in move]), final_score))
         return final_score
 
@@ -29,9 +55,10 @@ class Agent:
         this heuristic works as follows:
         get 1e6 if you win
         get -1e5 if you lose
-        get -1e3 if the opponent controls two squares in one direction and the third is empty
-        get 1e2 if you control two squares in one direction and the third is empty
+        get -1e3 if the opponent controls all but one square of a line and the last one is empty
+        get 1e2 if you control all but one square of a line and the last one is empty
         get 0 for a drawn game
+        (on the 3x3 board a line is a row, column or diagonal of three squares)
 
         previously the agent would get a bonus point for controlling the center, to force it to play there
         if no other moves were more urgent, but we have removed this behavior."""
@@ -49,40 +76,20 @@ class Agent:
         # initiate counters
         num_twos = 0
         num_twos_opp = 0
-        player_piece = board.pieces[player]
-        opponent_piece = board.pieces[1 - player]
-
-        # check the rows
-        row_player = [row.count(player_piece) for row in board.board]
-        row_opponent = [row.count(opponent_piece) for row in board.board]
-        for row in range(0, 3):  # two rows
-            if row_player[row] == 2 and row_opponent[row] == 0:
-                num_twos += 1
-            elif row_player[row] == 0 and row_opponent[row] == 2:
-                num_twos_opp += 1
-
-        # check the columns
-        cols = [[row[i] for row in board.board] for i in range(0, 3)]
-        col_player = [col.count(player_piece) for col in cols]
-        col_opponent = [col.count(opponent_piece) for col in cols]
-        for col in range(0, 3):  # three columns
-            if col_player[col] == 2 and col_opponent[col] == 0:
-                num_twos += 1
-            elif col_player[col] == 0 and col_opponent[col] == 2:
-                num_twos_opp += 1
+        player_bits = board.bitboards[player]
+        opponent_bits = board.bitboards[1 - player]
 
-        # check for diagonals
-        diags = [[board.board[i][i] for i in range(0, 3)], [board.board[j][2 - j] for j in range(0, 3)]]
-        diag_player = [diag.count(player_piece) for diag in diags]
-        diag_opponent = [diag.count(opponent_piece) for diag in diags]
-        for diag in range(0, 2):  # two diagonals
-            if diag_player[diag] == 2 and diag_opponent[diag] == 0:
+        # check the rows, columns and diagonals
+        threat = board.k - 1
+        for mask in board.geometry.lines:
+            player_count = bin(player_bits & mask).count('1')
+            opponent_count = bin(opponent_bits & mask).count('1')
+            if player_count == threat and opponent_count == 0:
                 num_twos += 1
-            elif diag_player[diag] == 0 and diag_opponent[diag] == 2:
+            elif player_count == 0 and opponent_count == threat:
                 num_twos_opp += 1
 
-        control_center = int(board.board[1][1] == player_piece)  # this is removed for now
-        control_center = 0
+        control_center = 0  # this used to be a bonus for holding the center square
 
         final_score = 1e2 * num_twos - 1e3 * num_twos_opp + control_center
         return final_score
@@ -97,12 +104,13 @@ class HumanAgent(Agent):
     def make_move(self, board):
         move_string = input(
             # 'Player {0} please make a move (row, col in the range 1-3)\n'.format(str(board.active_player + 1)))
-            '{0}, please make a move (row, col in the range 1-3)\n'.format(self.name))
+            '{0}, please make a move (row, col in the range 1-{1}, 1-{2})\n'.format(self.name, board.rows, board.cols))
         while ',' not in move_string:
             print('Please separate row and column by a comma\n')
             move_string = input(
                 # 'Player {0} please make a move (row, col in the range 1-3)\n'.format(str(board.active_player + 1)))
-                '{0}, please make a move (row, col in the range 1-3)\n'.format(self.name))
+                '{0}, please make a move (row, col in the range 1-{1}, 1-{2})\n'.format(self.name, board.rows,
+                                                                                        board.cols))
         print('')
 
         move_decomposed = [int(item.strip()) for item in move_string.split(",")]
@@ -118,7 +126,7 @@ class RandomAgent(Agent):
     def make_move(self, board):
         legal_moves = board.get_legal_moves()
         move = random.choice(legal_moves)
-        print("{0} made the move ({1})\n".format(self.name, ', '.join([str(comp + 1) for comp in move])))
+        self.announce_move(move)
         return move
 
 
@@ -130,66 +138,481 @@ class OneStepAgent(Agent):
 
     def make_move(self, board):
         legal_moves = board.get_legal_moves()
-        move_scores = [self.score_move(move, board) for move in legal_moves]
+        if tv is not None and type(self).compute_heuristic is Agent.compute_heuristic:
+            # score all candidate moves in one call to the vectorized version of compute_heuristic
+            children = tv.child_boards(board, legal_moves)
+            move_scores = tv.batch_heuristic(children, board.active_player, board.geometry).tolist()
+        else:
+            move_scores = [self.score_move(move, board) for move in legal_moves]
         move_score_dict = dict(zip(legal_moves, move_scores))
         best_score = max(move_scores)
         best_moves = [move for move in legal_moves if move_score_dict[move] == best_score]
         move = random.choice(best_moves)
-        print("{0} made the move ({1})\n".format(self.name, ', '.join([str(comp + 1) for comp in move])))
+        self.announce_move(move)
         return move
 
 
+class SearchTimeout(Exception):
+    """raised inside a search when the time budget for the current move has run out"""
+    pass
+
+
+class SearchStats:
+    """
+    Counters describing the search behind one move of NStepAgent: the positions visited (nodes), how many of those
+    were evaluated with compute_heuristic (leaves) and how many had their children searched (expanded), the number of
+    alpha-beta cutoffs, the deepest ply reached below the current position, transposition table hits and misses,
+    and the wall time in seconds. peak_memory is the peak traced allocation in bytes, if memory profiling was on.
+    """
+
+    def __init__(self):
+        self.nodes = 0
+        self.leaves = 0
+        self.expanded = 0
+        self.root_searches = 0
+        self.cutoffs = 0
+        self.max_depth = 0
+        self.table_hits = 0
+        self.table_misses = 0
+        self.wall_time = 0.0
+        self.peak_memory = None
+
+    @property
+    def branching_factor(self):
+        """the average number of children searched per expanded position"""
+        if self.expanded == 0:
+            return 0.0
+        return (self.nodes - self.root_searches) / self.expanded
+
+    def as_dict(self):
+        stats = dict(vars(self))
+        stats['branching_factor'] = self.branching_factor
+        return stats
+
+    def __str__(self):
+        return ('{0} nodes, {1} leaves, {2} cutoffs, depth {3}, branching factor {4:.2f}, '
+                'table hits {5}, misses {6}, {7:.1f} ms').format(self.nodes, self.leaves, self.cutoffs, self.max_depth,
+                                                                self.branching_factor, self.table_hits,
+                                                                self.table_misses, 1000 * self.wall_time)
+
+
+class TranspositionTable:
+    """
+    Remembers the results of earlier alpha-beta searches so that a position reached through a different move order,
+    or a rotation or reflection of one, is not searched again.
+
+    Each entry stores the value of a position, the remaining depth it was searched to and whether the value is
+    exact or only a lower or upper bound (because the search was cut off by the alpha-beta window).
+    Once more than max_size positions are stored, the least recently used entry is evicted.
+    """
+    EXACT = 0
+    LOWER_BOUND = 1
+    UPPER_BOUND = 2
+
+    def __init__(self, max_size=2 ** 16):
+        if max_size < 1:
+            raise ValueError('max_size must be at least 1')
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """returns the (value, depth, bound) entry stored for key, or None"""
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.entries.move_to_end(key)
+        return entry
+
+    def store(self, key, value, depth, bound):
+        """stores an entry for key, evicting the least recently used entry if the table is full"""
+        self.entries[key] = (value, depth, bound)
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        """removes all entries and resets the hit and miss counters"""
+        self.entries.clear()
+        self.hits = 0
+        self.misses = 0
+
+
 class NStepAgent(Agent):
     """This agent looks ahead N steps and picks the best move based on what it can foresee"""
 
-    def __init__(self, name='Minimax AI', nsteps=9, verbose=False):
+    CLOCK_CHECK_INTERVAL = 32  # number of nodes searched between checks of the time budget
+    ORDERINGS = ('none', 'threats', 'history')
+    SEARCHES = ('alphabeta', 'pvs')
+    NULL_WINDOW = 1e-6  # width of the window principal variation search uses to test moves after the first
+    NUM_KILLERS = 2  # number of killer moves remembered per ply
+
+    def __init__(self, name='Minimax AI', nsteps=9, verbose=False, table_size=2 ** 16, keep_table=False,
+                 move_radius=None, time_limit_ms=None, ordering='threats', search='alphabeta', workers=None,
+                 collect_stats=False, stats_callback=None, profile_path=None, memory_profile_path=None,
+                 cache_path=None):
+        """
+        table_size is the maximum number of positions kept in the transposition table; use 0 to disable it.
+        The table is kept for the whole game; with keep_table=True it is also kept from one game to the next.
+        With move_radius set, only empty squares within that many rows and columns of a piece are searched,
+        which keeps the search feasible on large boards. Those boards also need a small nsteps.
+        With time_limit_ms set, every move is searched 1, 2, 3, ... steps deep (up to nsteps) until the time
+        runs out, and the best move of the deepest finished search is played.
+
+        ordering decides the order in which the search tries moves; the better the first move, the more alpha-beta
+        can prune. 'none' uses the order of candidate_moves, 'threats' tries winning moves first, then moves that
+        block the opponent's win, then squares on many lines (the center and corners on the 3x3 board), and
+        'history' additionally moves killer moves and moves with a good history up front (see order_moves), which
+        pays off on the larger boards.
+        search selects alpha_beta_minimax ('alphabeta') or the negamax principal_variation_search ('pvs').
+        The number of positions visited during the last make_move is kept in node_count.
+
+        With workers set, the root moves are scored in parallel by a pool of that many processes, see parallel_scores.
+        The pool is started on the first move and reused until close() is called.
+
+        With collect_stats set, or a stats_callback given, every make_move fills a SearchStats in self.stats and
+        calls stats_callback(agent, move, stats) if given. When off, the search only does a few None checks extra.
+        In the parallel search the pool processes only report their node counts.
+        profile_path and memory_profile_path switch on cProfile and tracemalloc for every move and write the profile
+        (for pstats) and the memory snapshot (for tracemalloc.Snapshot.load) to those paths. A '{move}' in a path is
+        replaced by the number of moves played before this one.
+
+        With cache_path set, the transposition table is backed by the tictactoe_cache.PositionCache in that file:
+        entries missing from the table are looked up there, and new entries are also written there, so they are
+        shared with other processes and later runs. It needs the transposition table, so table_size must not be 0.
+        """
+        if ordering not in self.ORDERINGS:
+            raise ValueError('ordering must be one of {0}'.format(', '.join(self.ORDERINGS)))
+        if search not in self.SEARCHES:
+            raise ValueError('search must be one of {0}'.format(', '.join(self.SEARCHES)))
+        if workers is not None and time_limit_ms is not None:
+            raise ValueError('the parallel search does not support a time limit')
+        if cache_path is not None and not table_size:
+            raise ValueError('the position cache needs the transposition table')
         super().__init__(name=name)
         self.player = 'computer'
         self.nsteps = nsteps
         self.verbose = verbose
+        self.keep_table = keep_table
+        self.move_radius = move_radius
+        self.time_limit_ms = time_limit_ms
+        self.ordering = ordering
+        self.search = search
+        self.workers = workers
+        self.collect_stats = collect_stats or stats_callback is not None
+        self.stats_callback = stats_callback
+        self.profile_path = profile_path
+        self.memory_profile_path = memory_profile_path
+        self.stats = None
+        self.transposition_table = TranspositionTable(table_size) if table_size else None
+        self.cache_path = cache_path
+        self.position_cache = None
+        self.node_count = 0
+        self.killer_moves = {}  # ply -> the last moves that caused a cutoff at that ply
+        self.history = {}  # move -> how often, weighted by remaining depth, the move caused a cutoff
+        self._deadline = None
+        self._root_ply = 0
+        self._pool = None
+        self._shared_alpha = None
+
+    def new_game(self):
+        if self.transposition_table is not None and not self.keep_table:
+            self.transposition_table.clear()
+        self.killer_moves.clear()
+        self.history.clear()
+        if self.position_cache is not None:
+            self.position_cache.flush()
+
+    def cache_space(self, board):
+        """the name under which the position cache keeps the entries of this agent's searches on board"""
+        return '{0} {1}x{2} k={3} {4} radius={5}'.format(type(self).__name__, board.rows, board.cols, board.k,
+                                                         self.search, self.move_radius)
+
+    def open_cache(self, board):
+        """opens the position cache for searches on board, if cache_path is set and it is not open yet"""
+        if self.cache_path is None:
+            return
+        space = self.cache_space(board)
+        if self.position_cache is None or self.position_cache.space != space:
+            if self.position_cache is not None:
+                self.position_cache.close()
+            self.position_cache = tc.PositionCache(self.cache_path, space)
+
+    def candidate_moves(self, board):
+        """the moves the search considers: all legal moves, or only those near a piece if move_radius is set"""
+        if self.move_radius is None:
+            return board.get_legal_moves()
+        return board.get_nearby_moves(self.move_radius)
+
+    def order_moves(self, board, moves):
+        """
+        sorts moves so that the most promising are searched first: moves that win on the spot, then moves that stop
+        the opponent from winning on the spot, then (with 'history' ordering) the killer moves of this ply and moves
+        with a high history score, and finally squares that lie on the most lines
+        """
+        if self.ordering == 'none':
+            return moves
+
+        player_bits = board.bitboards[board.active_player]
+        opponent_bits = board.bitboards[1 - board.active_player]
+        lines_through = board.geometry.lines_through
+        use_history = self.ordering == 'history'
+        killers = self.killer_moves.get(len(board.moves), ()) if use_history else ()
+
+        def priority(move):
+            index = board.cols * move[0] + move[1]
+            bit = 1 << index
+            lines = lines_through[index]
+            wins = any((player_bits | bit) & line == line for line in lines)
+            blocks = any((opponent_bits | bit) & line == line for line in lines)
+            history = self.history.get(move, 0) if use_history else 0
+            return wins, blocks, move in killers, history, len(lines)
+
+        return sorted(moves, key=priority, reverse=True)
+
+    def record_cutoff(self, board, move, depth):
+        """remembers move as a killer move for this ply and raises its history score after it caused a cutoff"""
+        if self.stats is not None:
+            self.stats.cutoffs += 1
+        if self.ordering != 'history':
+            return
+        ply = len(board.moves)
+        killers = self.killer_moves.setdefault(ply, [])
+        if move not in killers:
+            killers.insert(0, move)
+            del killers[self.NUM_KILLERS:]
+        self.history[move] = self.history.get(move, 0) + depth * depth
 
     def make_move(self, board):
-        legal_moves = board.get_legal_moves()
-        move_scores = [self.score_move(move, board) for move in legal_moves]
+        self.open_cache(board)
+        self.node_count = 0
+        self._root_ply = len(board.moves)
+        self.stats = SearchStats() if self.collect_stats else None
+        table = self.transposition_table
+        if self.stats is not None and table is not None:
+            table_hits, table_misses = table.hits, table.misses
+
+        profiler = None
+        if self.profile_path is not None:
+            profiler = cProfile.Profile()
+            profiler.enable()
+        if self.memory_profile_path is not None:
+            # a trace the caller started is left running; only its peak is reset, to measure this move's
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start()
+            else:
+                tracemalloc.reset_peak()
+            traced_before = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+
+        move = self.choose_move(board)
+
+        wall_time = time.perf_counter() - start
+        if profiler is not None:
+            profiler.disable()
+            profiler.dump_stats(self.profile_path.format(move=self._root_ply))
+        if self.memory_profile_path is not None:
+            tracemalloc.take_snapshot().dump(self.memory_profile_path.format(move=self._root_ply))
+            peak_memory = tracemalloc.get_traced_memory()[1] - traced_before
+            if started_tracing:
+                tracemalloc.stop()
+
+        if self.stats is not None:
+            self.stats.nodes = self.node_count
+            self.stats.wall_time = wall_time
+            if table is not None:
+                self.stats.table_hits = table.hits - table_hits
+                self.stats.table_misses = table.misses - table_misses
+            if self.memory_profile_path is not None:
+                self.stats.peak_memory = peak_memory
+            if self.verbose:
+                print(self.stats)
+            if self.stats_callback is not None:
+                self.stats_callback(self, move, self.stats)
+
+        self.announce_move(move)
+        return move
+
+    def choose_move(self, board):
+        """scores the candidate moves and picks one of the best at random"""
+        legal_moves = self.candidate_moves(board)
+        if self.workers is not None:
+            move_scores = self.parallel_scores(board, legal_moves)
+        elif self.time_limit_ms is None:
+            move_scores = [self.score_move(move, board) for move in legal_moves]
+        else:
+            move_scores = self.iterative_deepening(board, legal_moves)
         move_score_dict = dict(zip(legal_moves, move_scores))
         best_score = max(move_scores)
         best_moves = [move for move in legal_moves if move_score_dict[move] == best_score]
         move = random.choice(best_moves)
-        print("{0} made the move ({1})\n".format(self.name, ', '.join([str(comp + 1) for comp in move])))
+        if self.verbose:
+            print('searched {0} positions'.format(self.node_count))
         return move
 
+    def parallel_scores(self, board, legal_moves):
+        """
+        scores legal_moves in the process pool. The pool shares the best score found so far, which every root search
+        uses as its alpha bound: the first move (in search order) is scored on its own to establish that bound, then
+        the other moves are scored in parallel ('young brothers wait').
+
+        A root move is searched with a window just below the shared bound, so every move that scores at least as
+        well as the best one so far gets its exact score, just like in the serial search; the best score and the set
+        of best moves to pick from are therefore the same. Moves that turn out worse only get an upper bound on
+        their score, which is at most the best score.
+        """
+        if self._pool is None:
+            self._shared_alpha = multiprocessing.Value('d', -math.inf)
+            self._pool = ProcessPoolExecutor(max_workers=self.workers, initializer=_init_search_worker,
+                                             initargs=(self._shared_alpha,))
+        self._shared_alpha.value = -math.inf
+
+        table = self.transposition_table
+        settings = (type(self), self.nsteps, table.max_size if table is not None else 0, self.move_radius,
+                    self.ordering, self.search, self.cache_path)
+        position = (board.rows, board.cols, board.k, tuple(board.moves))
+        order = self.order_moves(board, legal_moves)
+
+        first = self._pool.submit(_score_root_move, settings, position, order[0])
+        results = {order[0]: first.result()}
+        futures = {move: self._pool.submit(_score_root_move, settings, position, move) for move in order[1:]}
+        for move, future in futures.items():
+            results[move] = future.result()
+
+        self.node_count += sum(node_count for _, node_count in results.values())
+        move_scores = [results[move][0] for move in legal_moves]
+        if self.verbose:
+            for move, score in zip(legal_moves, move_scores):
+                print('score of move ({0}) is: {1}'.format(', '.join([str(comp + 1) for comp in move]), score))
+        return move_scores
+
+    def close(self):
+        """shuts down the process pool of the parallel search, if it was started, and closes the position cache"""
+        if self._pool is not None:
+            self._pool.shutdown()
+            self._pool = None
+            self._shared_alpha = None
+        if self.position_cache is not None:
+            self.position_cache.close()
+            self.position_cache = None
+
+    def iterative_deepening(self, board, legal_moves):
+        """
+        scores legal_moves with searches of increasing depth until time_limit_ms has passed and returns the scores
+        from the deepest search that finished. Each search visits the moves in order of the scores the previous one
+        gave them. The shallowest search always finishes, so there is always a move to play.
+        """
+        deadline = time.perf_counter() + self.time_limit_ms / 1000
+        num_moves = len(board.moves)
+        max_depth = min(self.nsteps, board.num_squares - num_moves - 1)
+        order = list(range(0, len(legal_moves)))
+        move_scores = None
+
+        for depth in range(0, max_depth + 1):
+            scores = [None] * len(legal_moves)
+            try:
+                for i in order:
+                    scores[i] = self.score_move(legal_moves[i], board, depth=depth)
+            except SearchTimeout:
+                # the search stopped halfway down the tree, so take back the moves it had made
+                while len(board.moves) > num_moves:
+                    board.undo_move()
+                break
+            finally:
+                self._deadline = None
+
+            move_scores = scores
+            if self.verbose:
+                print('finished the search {0} steps deep\n'.format(depth + 1))
+            if time.perf_counter() >= deadline:
+                break
+            order.sort(key=lambda index: move_scores[index], reverse=True)
+            self._deadline = deadline
+
+        return move_scores
+
     @staticmethod
     def compute_heuristic(board, player):
         """compute 'score' of a board from the perspective of the player selected
         this heuristic works as follows:
-        get 10 if you win
-        get -10 if you lose
-        get 0 in all other cases"""
+        get 100 minus the number of moves played if you win, so that faster wins score higher
+        (boards with more than 99 squares use the number of squares plus one instead of 100)
+        get minus that if you lose
+        get 0 for a draw
+        if the search stopped before the game ended, get a score strictly between -1 and 1 from evaluate_lines"""
 
         outcome = board.game_end()
         if outcome:
+            win_score = max(100, board.num_squares + 1)
             if board.winner == player:
-                return 100 - len(board.moves)
+                return win_score - len(board.moves)
             elif board.winner == 1 - player:
-                return -100 + len(board.moves)
-        return 0
+                return -win_score + len(board.moves)
+            return 0
+        return NStepAgent.evaluate_lines(board, player)
 
-    def score_move(self, move, board):
-        """this version of score_move uses minimax to look n steps ahead"""
+    @staticmethod
+    def evaluate_lines(board, player):
+        """
+        scores an unfinished game from the perspective of player, as a number strictly between -1 and 1.
+        Every line holding pieces of only one player is worth 4 ** (number of pieces) to that player;
+        lines holding pieces of both players can no longer be won and are worth nothing.
+        """
+        player_bits = board.bitboards[player]
+        opponent_bits = board.bitboards[1 - player]
+        lines_through = board.geometry.lines_through
+        player_score = 0
+        opponent_score = 0
+
+        # only lines through a piece can hold pieces of just one player
+        seen = set()
+        for row, col, _ in board.moves:
+            for line in lines_through[board.cols * row + col]:
+                if line in seen:
+                    continue
+                seen.add(line)
+                player_count = bin(player_bits & line).count('1')
+                opponent_count = bin(opponent_bits & line).count('1')
+                if opponent_count == 0:
+                    player_score += 4 ** player_count
+                elif player_count == 0:
+                    opponent_score += 4 ** opponent_count
+
+        return (player_score - opponent_score) / (player_score + opponent_score + 1)
+
+    def score_move(self, move, board, depth=None, alpha=-math.inf):
+        """
+        this version of score_move uses minimax to look n steps ahead, where n is depth or else self.nsteps.
+        If the score is at most alpha, the search may stop early and return any value between the score and alpha.
+        """
+        if depth is None:
+            depth = self.nsteps
+        if self.stats is not None:
+            self.stats.root_searches += 1
         player = board.active_player
-        temp_board = copy.deepcopy(board)
         move_row, move_col = move
-        temp_board.place_piece(row=move_row, col=move_col, player=player)
-        alpha_beta_score = self.alpha_beta_minimax(board=temp_board,
-                                              depth=self.nsteps,
-                                              alpha=-math.inf,
-                                              beta=math.inf,
-                                              maximizing_player=False,
-                                              player=player)
+        board.place_piece(row=move_row, col=move_col, player=player)
+        if self.search == 'pvs':
+            alpha_beta_score = -self.principal_variation_search(board=board, depth=depth, alpha=-math.inf, beta=-alpha)
+        else:
+            alpha_beta_score = self.alpha_beta_minimax(board=board,
+                                                  depth=depth,
+                                                  alpha=alpha,
+                                                  beta=math.inf,
+                                                  maximizing_player=False,
+                                                  player=player)
+        board.undo_move()
         if self.verbose:
             print('score of move ({0}) is: {1}'.format(', '.join([str(comp + 1) for comp in move]), alpha_beta_score))
 
-        # simple_score = self.simple_minimax(board=temp_board,
+        # simple_score = self.simple_minimax(board=board,
         #                                   depth=self.nsteps,
         #                                   maximizing_player=False,
         #                                   player=player)
@@ -222,30 +645,30 @@ class NStepAgent(Agent):
 
         if maximizing_player:
             value = -math.inf
-            legal_moves = board.get_legal_moves()
+            legal_moves = self.candidate_moves(board)
 
             for move in legal_moves:
-                temp_board = copy.deepcopy(board)
                 move_row, move_col = move
-                temp_board.place_piece(row=move_row, col=move_col, player=temp_board.active_player)
-                value = max(value, self.simple_minimax(temp_board,
+                board.place_piece(row=move_row, col=move_col, player=board.active_player)
+                value = max(value, self.simple_minimax(board,
                                                        depth=depth - 1,
                                                        maximizing_player=False,
                                                        player=player))
+                board.undo_move()
             return value
 
         else:
             value = math.inf
-            legal_moves = board.get_legal_moves()
+            legal_moves = self.candidate_moves(board)
 
             for move in legal_moves:
-                temp_board = copy.deepcopy(board)
                 move_row, move_col = move
-                temp_board.place_piece(row=move_row, col=move_col, player=temp_board.active_player)
-                value = min(value, self.simple_minimax(temp_board,
+                board.place_piece(row=move_row, col=move_col, player=board.active_player)
+                value = min(value, self.simple_minimax(board,
                                                        depth=depth - 1,
                                                        maximizing_player=True,
                                                        player=player))
+                board.undo_move()
             return value
 
     def alpha_beta_minimax(self, board, depth, alpha, beta, maximizing_player, player):
@@ -277,48 +700,469 @@ class NStepAgent(Agent):
         alphabeta(origin, depth, −∞, +∞, TRUE)
         """
 
+        self.count_node(board)
         if depth == 0 or board.game_end():
+            if self.stats is not None:
+                self.stats.leaves += 1
             return self.compute_heuristic(board, player)
 
+        table = self.transposition_table
+        if table is not None:
+            # searching deeper than the number of empty squares gives the same result, so share those entries
+            depth = min(depth, board.num_squares - len(board.moves))
+            key = board.canonical_hash << 1 | player
+            value, alpha, beta = self.probe_table(key, depth, alpha, beta)
+            if value is not None:
+                return value
+            alpha_original, beta_original = alpha, beta
+        if self.stats is not None:
+            self.stats.expanded += 1
+
         if maximizing_player:
             value = -math.inf
-            legal_moves = board.get_legal_moves()
+            legal_moves = self.order_moves(board, self.candidate_moves(board))
 
             for move in legal_moves:
-                temp_board = copy.deepcopy(board)
                 move_row, move_col = move
-                temp_board.place_piece(row=move_row, col=move_col, player=temp_board.active_player)
-                value = max(value, self.alpha_beta_minimax(board=temp_board,
+                board.place_piece(row=move_row, col=move_col, player=board.active_player)
+                value = max(value, self.alpha_beta_minimax(board=board,
                                                            depth=depth - 1,
                                                            alpha=alpha,
                                                            beta=beta,
                                                            maximizing_player=False,
                                                            player=player))
+                board.undo_move()
                 alpha = max(alpha, value)
 
                 if alpha >= beta:
+                    self.record_cutoff(board, move, depth)
                     break
-            return value
 
         else:
             value = math.inf
-            legal_moves = board.get_legal_moves()
+            legal_moves = self.order_moves(board, self.candidate_moves(board))
 
             for move in legal_moves:
-                temp_board = copy.deepcopy(board)
                 move_row, move_col = move
-                temp_board.place_piece(row=move_row, col=move_col, player=temp_board.active_player)
-                value = min(value, self.alpha_beta_minimax(board=temp_board,
+                board.place_piece(row=move_row, col=move_col, player=board.active_player)
+                value = min(value, self.alpha_beta_minimax(board=board,
                                                            depth=(depth - 1),
                                                            alpha=alpha,
                                                            beta=beta,
                                                            maximizing_player=True,
                                                            player=player))
+                board.undo_move()
                 beta = min(beta, value)
 
                 if beta <= alpha:
+                    self.record_cutoff(board, move, depth)
                     break
-            return value
+
+        if table is not None:
+            self.store_table(key, value, depth, alpha_original, beta_original)
+        return value
+
+    def principal_variation_search(self, board, depth, alpha, beta):
+        """
+        negamax version of alpha_beta_minimax with principal variation search, returning the value of the position
+        for the player to move. Every node has a single maximizing branch: a child's value for its own player to move
+        is negated to get its value for this node's player.
+        The first (best ordered) move is searched with the full window. Every later move is first tested with a
+        null window around alpha, which only proves it is no better and prunes much more; only moves that fail
+        that test are searched again with the full window.
+        see: https://en.wikipedia.org/wiki/Principal_variation_search
+        """
+        self.count_node(board)
+        if depth == 0 or board.game_end():
+            if self.stats is not None:
+                self.stats.leaves += 1
+            return self.compute_heuristic(board, board.active_player)
+
+        table = self.transposition_table
+        if table is not None:
+            depth = min(depth, board.num_squares - len(board.moves))
+            key = board.canonical_hash << 1 | board.active_player
+            value, alpha, beta = self.probe_table(key, depth, alpha, beta)
+            if value is not None:
+                return value
+            alpha_original, beta_original = alpha, beta
+        if self.stats is not None:
+            self.stats.expanded += 1
+
+        value = -math.inf
+        legal_moves = self.order_moves(board, self.candidate_moves(board))
+
+        for i, move in enumerate(legal_moves):
+            move_row, move_col = move
+            board.place_piece(row=move_row, col=move_col, player=board.active_player)
+            if i == 0:
+                score = -self.principal_variation_search(board, depth - 1, -beta, -alpha)
+            else:
+                score = -self.principal_variation_search(board, depth - 1, -alpha - self.NULL_WINDOW, -alpha)
+                if alpha < score < beta:
+                    score = -self.principal_variation_search(board, depth - 1, -beta, -alpha)
+            board.undo_move()
+
+            value = max(value, score)
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                self.record_cutoff(board, move, depth)
+                break
+
+        if table is not None:
+            self.store_table(key, value, depth, alpha_original, beta_original)
+        return value
+
+    def count_node(self, board):
+        """counts a visited position and raises SearchTimeout once in a while if the time budget has run out"""
+        self.node_count += 1
+        if self.stats is not None and len(board.moves) - self._root_ply > self.stats.max_depth:
+            self.stats.max_depth = len(board.moves) - self._root_ply
+        if self._deadline is not None and self.node_count % self.CLOCK_CHECK_INTERVAL == 0:
+            if time.perf_counter() >= self._deadline:
+                raise SearchTimeout()
+
+    def probe_table(self, key, depth, alpha, beta):
+        """
+        looks up key in the transposition table. Returns (value, alpha, beta), where value is the stored value
+        if it settles the position for this window or else None, and alpha and beta are narrowed by a stored bound.
+        Only entries searched to exactly this depth are used, so a search gives the same result whatever the table
+        holds; the parallel search depends on that to match the serial one.
+        """
+        entry = self.transposition_table.lookup(key)
+        if entry is None and self.position_cache is not None:
+            entry = self.position_cache.lookup(key)
+            if entry is not None:
+                self.transposition_table.store(key, *entry)
+        if entry is not None:
+            entry_value, entry_depth, entry_bound = entry
+            if entry_depth == depth:
+                if entry_bound == TranspositionTable.EXACT:
+                    return entry_value, alpha, beta
+                elif entry_bound == TranspositionTable.LOWER_BOUND:
+                    alpha = max(alpha, entry_value)
+                else:
+                    beta = min(beta, entry_value)
+                if alpha >= beta:
+                    return entry_value, alpha, beta
+        return None, alpha, beta
+
+    def store_table(self, key, value, depth, alpha, beta):
+        """stores the value found by a search with window alpha, beta, as an exact value or a bound"""
+        if value <= alpha:
+            bound = TranspositionTable.UPPER_BOUND
+        elif value >= beta:
+            bound = TranspositionTable.LOWER_BOUND
+        else:
+            bound = TranspositionTable.EXACT
+        self.transposition_table.store(key, value, depth, bound)
+        if self.position_cache is not None:
+            self.position_cache.store(key, value, depth, bound)
+
+
+# State of a process in the pool of NStepAgent.parallel_scores
+_shared_alpha = None  # the best root score found so far, shared by all processes
+_worker_agents = {}  # agent settings -> the agent this process searches with, so its transposition table stays warm
+
+
+def _init_search_worker(shared_alpha):
+    global _shared_alpha
+    _shared_alpha = shared_alpha
+
+
+def _score_root_move(settings, position, move):
+    """scores move on the given position with an agent of the given settings; runs in a pool process"""
+    agent = _worker_agents.get(settings)
+    if agent is None:
+        agent_class, nsteps, table_size, move_radius, ordering, search, cache_path = settings
+        agent = agent_class(nsteps=nsteps, table_size=table_size, keep_table=True, move_radius=move_radius,
+                            ordering=ordering, search=search, cache_path=cache_path)
+        _worker_agents[settings] = agent
+
+    rows, cols, k, moves = position
+    board = te.GameBoard(rows=rows, cols=cols, k=k)
+    for move_row, move_col, player in moves:
+        board.place_piece(row=move_row, col=move_col, player=player)
+
+    agent.open_cache(board)
+    agent.node_count = 0
+    score = agent.score_move(move, board, alpha=_shared_alpha.value - NStepAgent.NULL_WINDOW)
+    with _shared_alpha.get_lock():
+        if score > _shared_alpha.value:
+            _shared_alpha.value = score
+    if agent.position_cache is not None:
+        # pool processes are never closed, so they write their entries back after every root move
+        agent.position_cache.flush()
+    return score, agent.node_count
+
+
+class TablebaseAgent(Agent):
+    """
+    This agent plays perfectly by looking up every candidate move in the precomputed table from tictactoe_tablebase.
+    It picks the same moves as NStepAgent with a full-depth search, without searching.
+    """
+
+    def __init__(self, name='Tablebase AI', path=tb.TABLEBASE_PATH):
+        super().__init__(name=name)
+        self.player = 'computer'
+        self.table = tb.load_tablebase(path)
+
+    def score_move(self, move, board):
+        """the value of the position after move for the player to move now, read from the table"""
+        if (board.rows, board.cols, board.k) != (3, 3, 3):
+            raise ValueError('the tablebase only covers the 3x3 board')
+        move_row, move_col = move
+        board.place_piece(row=move_row, col=move_col, player=board.active_player)
+        score = -tb.lookup(self.table, board)
+        board.undo_move()
+        return score
+
+    def make_move(self, board):
+        legal_moves = board.get_legal_moves()
+        move_scores = [self.score_move(move, board) for move in legal_moves]
+        best_score = max(move_scores)
+        best_moves = [move for move, score in zip(legal_moves, move_scores) if score == best_score]
+        move = random.choice(best_moves)
+        self.announce_move(move)
+        return move
+
+
+class LearnedAgent(Agent):
+    """
+    This agent plays the move leading to the position with the best value in a table learned by self-play with
+    tictactoe_learning. Every candidate move costs one table lookup, so it moves equally fast on any board and at any
+    stage of the game. Positions missing from the table count as even.
+    """
+
+    def __init__(self, name='Learned AI', path=None, move_radius=None):
+        """
+        path defaults to the table for the 3x3 board; with move_radius only moves near earlier pieces are considered
+        """
+        super().__init__(name=name)
+        self.player = 'computer'
+        self.table = tl.ValueTable.load(path if path is not None else tl.value_table_path())
+        self.move_radius = move_radius
+
+    def make_move(self, board):
+        if (board.rows, board.cols, board.k) != (self.table.rows, self.table.cols, self.table.k):
+            raise ValueError('the value table was learned on a {0}x{1} board with k={2}'.format(
+                self.table.rows, self.table.cols, self.table.k))
+
+        legal_moves = tl.candidate_moves(board, self.move_radius)
+        move_scores = tl.move_values(board, self.table, legal_moves)
+        best_score = max(move_scores)
+        best_moves = [move for move, score in zip(legal_moves, move_scores) if score == best_score]
+        move = random.choice(best_moves)
+        self.announce_move(move)
+        return move
+
+
+class MCTSAgent(Agent):
+    """
+    This agent uses Monte Carlo tree search: it plays many random games (playouts) from the current position and
+    grows a search tree towards the moves that did well in them, choosing which move to explore with UCT.
+    see: https://en.wikipedia.org/wiki/Monte_Carlo_tree_search
+
+    The tree is stored in flat arrays indexed by node number instead of as node objects. The children of a node
+    take up consecutive node numbers, starting at first_child. Each node records the square of the move leading
+    to it, how often it was visited and the total result of those visits for the player who made that move
+    (1 for a win, 0.5 for a draw). Node 0 is the current position.
+    """
+
+    def __init__(self, name='MCTS AI', playouts=2000, time_limit_ms=None, exploration=math.sqrt(2),
+                 max_nodes=2 ** 18, reuse_tree=True):
+        """
+        Every move runs playouts playouts, or, with time_limit_ms set, as many as fit in that many milliseconds.
+        exploration is the UCT constant; higher values try more unpromising moves.
+        The tree grows to max_nodes nodes at most; after that playouts still run, but the tree is not expanded. The
+        current position is always expanded, though, so that there are moves to choose from.
+        With reuse_tree the part of the tree below the position after the opponent's reply is kept for the next move.
+        """
+        super().__init__(name=name)
+        self.player = 'computer'
+        self.playouts = playouts
+        self.time_limit_ms = time_limit_ms
+        self.exploration = exploration
+        self.max_nodes = max_nodes
+        self.reuse_tree = reuse_tree
+        self.playout_count = 0  # playouts run during the last make_move
+        self._clear_tree()
+
+    def new_game(self):
+        self._clear_tree()
+
+    @property
+    def num_nodes(self):
+        return len(self._visits)
+
+    def _clear_tree(self):
+        self._first_child = array('i')  # -1 for nodes that have not been expanded
+        self._num_children = array('H')
+        self._move = array('H')
+        self._visits = array('I')
+        self._value = array('d')
+        self._root_moves = None  # board.moves when node 0 was the current position
+
+    def _add_node(self, move):
+        self._first_child.append(-1)
+        self._num_children.append(0)
+        self._move.append(move)
+        self._visits.append(0)
+        self._value.append(0.0)
+
+    def make_move(self, board):
+        if self.reuse_tree:
+            self._advance_root(board)
+        else:
+            self._clear_tree()
+        if not self._visits:
+            self._add_node(0)
+
+        self.playout_count = 0
+        if self.time_limit_ms is None:
+            for _ in range(0, self.playouts):
+                self._run_playout(board)
+            self.playout_count = self.playouts
+        else:
+            deadline = time.perf_counter() + self.time_limit_ms / 1000
+            while self.playout_count == 0 or time.perf_counter() < deadline:
+                for _ in range(0, 16):
+                    self._run_playout(board)
+                self.playout_count += 16
+
+        # play the most visited move, which is the most reliable estimate of the best one
+        first = self._first_child[0]
+        children = range(first, first + self._num_children[0])
+        most_visits = max(self._visits[child] for child in children)
+        square = random.choice([self._move[child] for child in children if self._visits[child] == most_visits])
+        self._root_moves = list(board.moves)
+
+        move = (square // board.cols, square % board.cols)
+        self.announce_move(move)
+        return move
+
+    def _advance_root(self, board):
+        """makes the node for the position on board the root, keeping its subtree, or else clears the tree"""
+        previous = self._root_moves
+        if previous is None or not self._visits or board.moves[:len(previous)] != previous:
+            self._clear_tree()
+            return
+
+        node = 0
+        for row, col, _ in board.moves[len(previous):]:
+            square = board.cols * row + col
+            first = self._first_child[node]
+            node = next((child for child in range(first, first + self._num_children[node])
+                         if self._move[child] == square), None) if first != -1 else None
+            if node is None:
+                self._clear_tree()
+                return
+        if node != 0:
+            self._reroot(node)
+
+    def _reroot(self, root):
+        """copies the subtree below root into new arrays, with root as node 0, and drops the rest of the tree"""
+        first_child, num_children, moves, visits, values = (self._first_child, self._num_children, self._move,
+                                                            self._visits, self._value)
+        self._clear_tree()
+        self._add_node(moves[root])
+        self._visits[0] = visits[root]
+        self._value[0] = values[root]
+
+        queue = deque([(root, 0)])
+        while queue:
+            old_node, new_node = queue.popleft()
+            first = first_child[old_node]
+            if first == -1:
+                continue
+            new_first = len(self._visits)
+            self._first_child[new_node] = new_first
+            self._num_children[new_node] = num_children[old_node]
+            for offset in range(0, num_children[old_node]):
+                child = first + offset
+                self._add_node(moves[child])
+                self._visits[new_first + offset] = visits[child]
+                self._value[new_first + offset] = values[child]
+                queue.append((child, new_first + offset))
+
+    def _run_playout(self, board):
+        """
+        walks down the tree with UCT, expands the node it ends at, plays the game out at random from there and
+        records the result in every node on the way
+        """
+        first_child, num_children, moves, visits, values = (self._first_child, self._num_children, self._move,
+                                                            self._visits, self._value)
+        lines_through = board.geometry.lines_through
+        full_board = board.geometry.full_board
+        bits = list(board.bitboards)
+        occupied = bits[0] | bits[1]
+        player = board.active_player
+        winner = board.winner
+
+        node = 0
+        path = [(0, -1)]  # the nodes visited, with the player who made the move leading to them
+        while winner == -1 and occupied != full_board:
+            first = first_child[node]
+            if first == -1:
+                empty = [square for square in range(0, board.num_squares) if not occupied >> square & 1]
+                if node != 0 and len(visits) + len(empty) > self.max_nodes:
+                    break
+                # expand the node, in random order so that unvisited children are tried at random
+                random.shuffle(empty)
+                first = len(visits)
+                first_child[node] = first
+                num_children[node] = len(empty)
+                for square in empty:
+                    self._add_node(square)
+
+            # select the child with the highest upper confidence bound; unvisited children go first
+            log_visits = math.log(visits[node]) if visits[node] > 0 else 0.0
+            best_child = first
+            best_bound = -1.0
+            for child in range(first, first + num_children[node]):
+                child_visits = visits[child]
+                if child_visits == 0:
+                    best_child = child
+                    break
+                bound = values[child] / child_visits + self.exploration * math.sqrt(log_visits / child_visits)
+                if bound > best_bound:
+                    best_child = child
+                    best_bound = bound
+
+            node = best_child
+            square = moves[node]
+            bits[player] |= 1 << square
+            occupied |= 1 << square
+            for line in lines_through[square]:
+                if bits[player] & line == line:
+                    winner = player
+                    break
+            path.append((node, player))
+            player = 1 - player
+
+            if visits[node] == 0:
+                break
+
+        # random playout on the bitboards
+        if winner == -1 and occupied != full_board:
+            empty = [square for square in range(0, board.num_squares) if not occupied >> square & 1]
+            random.shuffle(empty)
+            for square in empty:
+                bits[player] |= 1 << square
+                for line in lines_through[square]:
+                    if bits[player] & line == line:
+                        winner = player
+                        break
+                if winner != -1:
+                    break
+                player = 1 - player
+
+        for path_node, mover in path:
+            visits[path_node] += 1
+            if winner == -1:
+                values[path_node] += 0.5
+            elif winner == mover:
+                values[path_node] += 1.0
 
 
 # Purely for testing purposes - this should be called from tictactoe game
@@ -0,0 +1,238 @@
+"""
+A position cache that outlives the process: search results stored in a SQLite file
+
+NStepAgent(cache_path=...) keeps the entries of its transposition table in such a file as well, so that other
+processes, like the workers of a parallel search or of a tournament, and later runs can reuse them instead of
+searching the same positions again. Entries are only shared between agents whose searches give the same values:
+the same agent class, board, search and move radius (see NStepAgent.cache_space).
+
+The file is opened in write-ahead-log mode, so any number of processes can read it while one of them writes.
+Each PositionCache keeps the most recently used entries of its space in memory, starting with those in the file
+when it is opened; a key missing there is looked up in the file, so entries other processes have written since are
+found too. New entries are written back in batches. Once the file holds more than max_entries entries, the least
+recently used ones are deleted.
+
+Run this file to warm up a cache with the positions searched in a tournament, before it is needed, e.g.:
+    python tictactoe_cache.py warmup positions.db nstep random --games 200 --workers 4
+"""
+
+import argparse
+import sqlite3
+import time
+from collections import OrderedDict
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS spaces (
+    id INTEGER PRIMARY KEY,
+    name TEXT UNIQUE NOT NULL
+);
+CREATE TABLE IF NOT EXISTS positions (
+    space INTEGER NOT NULL,
+    hash INTEGER NOT NULL,
+    side INTEGER NOT NULL,
+    value REAL NOT NULL,
+    depth INTEGER NOT NULL,
+    bound INTEGER NOT NULL,
+    used REAL NOT NULL,
+    PRIMARY KEY (space, hash, side)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS positions_used ON positions (used);
+'''
+BUSY_TIMEOUT_S = 30  # how long to wait for another process that is writing
+EVICT_TO = 0.9  # eviction deletes down to this fraction of max_entries, so it does not run again on the next flush
+
+
+def to_row_key(key):
+    """splits a transposition table key (canonical hash << 1 | player) into a signed 64-bit hash and the player"""
+    position_hash = key >> 1
+    if position_hash >= 1 << 63:
+        position_hash -= 1 << 64
+    return position_hash, key & 1
+
+
+def from_row_key(position_hash, side):
+    return (position_hash & (1 << 64) - 1) << 1 | side
+
+
+class PositionCache:
+    """
+    The entries of one space of the cache file at path: (value, depth, bound) by transposition table key.
+    At most memory_size of them are kept in memory, the least recently used one being dropped first.
+    Stores are kept in memory and written to the file once flush_size of them have piled up, on flush() and on
+    close(); so are the times entries were last used, which decide what gets evicted from the file.
+    """
+
+    def __init__(self, path, space, max_entries=2 ** 20, flush_size=4096, memory_size=2 ** 18):
+        self.path = path
+        self.space = space
+        self.max_entries = max_entries
+        self.flush_size = flush_size
+        self.memory_size = memory_size
+        self.connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S, isolation_level=None)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.transaction():
+            for statement in filter(str.strip, SCHEMA.split(';')):
+                self.connection.execute(statement)
+            self.connection.execute('INSERT OR IGNORE INTO spaces (name) VALUES (?)', (space,))
+        self.space_id = self.connection.execute('SELECT id FROM spaces WHERE name = ?', (space,)).fetchone()[0]
+
+        self.entries = OrderedDict()
+        self.reload()
+        self.pending = {}  # key -> entry stored since the last flush
+        self.used = set()  # keys of entries looked up since the last flush
+        self.absent = set()  # keys not in the file at the last look; cleared by flush to see newer entries
+        # the number of entries in the file at the last count plus those written since by this cache; the file is
+        # only counted again, and evicted from, once this exceeds max_entries
+        self.file_entries = self.connection.execute('SELECT count(*) FROM positions').fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+
+    def transaction(self):
+        return _Transaction(self.connection)
+
+    def reload(self):
+        """reads the memory_size most recently used entries of this space from the file"""
+        rows = self.connection.execute('SELECT hash, side, value, depth, bound FROM positions WHERE space = ? '
+                                       'ORDER BY used DESC LIMIT ?', (self.space_id, self.memory_size)).fetchall()
+        self.entries = OrderedDict((from_row_key(position_hash, side), (value, depth, bound))
+                                   for position_hash, side, value, depth, bound in reversed(rows))
+
+    def remember(self, key, entry):
+        """keeps entry in memory, dropping the least recently used entry if there are more than memory_size"""
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.memory_size:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def lookup(self, key):
+        """returns the (value, depth, bound) entry stored for key, or None; looks in the file if it is not in memory"""
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        else:
+            entry = self.pending.get(key)
+            if entry is None and key not in self.absent:
+                entry = self.connection.execute(
+                    'SELECT value, depth, bound FROM positions WHERE space = ? AND hash = ? AND side = ?',
+                    (self.space_id, *to_row_key(key))).fetchone()
+                if entry is None:
+                    self.absent.add(key)
+            if entry is not None:
+                self.remember(key, tuple(entry))
+        if entry is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+            self.used.add(key)
+        return entry
+
+    def store(self, key, value, depth, bound):
+        self.pending[key] = (value, depth, bound)
+        self.remember(key, self.pending[key])
+        self.absent.discard(key)
+        if len(self.pending) >= self.flush_size:
+            self.flush()
+
+    def flush(self):
+        """writes the pending entries and use times to the file, then evicts entries beyond max_entries"""
+        self.absent.clear()
+        if not self.pending and not self.used:
+            return
+        now = time.time()
+        with self.transaction():
+            self.connection.executemany(
+                'INSERT OR REPLACE INTO positions (space, hash, side, value, depth, bound, used) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(self.space_id, *to_row_key(key), value, depth, bound, now)
+                 for key, (value, depth, bound) in self.pending.items()])
+            self.connection.executemany(
+                'UPDATE positions SET used = ? WHERE space = ? AND hash = ? AND side = ?',
+                [(now, self.space_id, *to_row_key(key)) for key in self.used - self.pending.keys()])
+            self.file_entries += len(self.pending)
+            if self.file_entries > self.max_entries:
+                self.file_entries = self.connection.execute('SELECT count(*) FROM positions').fetchone()[0]
+            if self.file_entries > self.max_entries:
+                excess = self.file_entries - int(EVICT_TO * self.max_entries)
+                self.connection.execute(
+                    'DELETE FROM positions WHERE (space, hash, side) IN '
+                    '(SELECT space, hash, side FROM positions ORDER BY used LIMIT ?)', (excess,))
+                self.file_entries -= excess
+        self.pending.clear()
+        self.used.clear()
+
+    def close(self):
+        self.flush()
+        self.connection.close()
+
+
+class _Transaction:
+    """takes the write lock of the file for the duration of a with block, and commits or rolls back at the end"""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, *exc_info):
+        self.connection.execute('COMMIT' if exc_type is None else 'ROLLBACK')
+
+
+def cache_statistics(path):
+    """the number of entries per space in the cache file at path"""
+    connection = sqlite3.connect(path, timeout=BUSY_TIMEOUT_S)
+    try:
+        return dict(connection.execute('SELECT name, count(positions.hash) FROM spaces '
+                                       'LEFT JOIN positions ON positions.space = spaces.id GROUP BY name'))
+    finally:
+        connection.close()
+
+
+def warm_up(path, spec_1, spec_2, num_games, workers=None, seed=0, rows=3, cols=3, k=3):
+    """
+    plays a tournament in which every nstep agent uses the cache at path, so that the cache holds the positions
+    such games search. Returns the tournament report
+    """
+    import tournament  # imports the agents, which import this module
+
+    specs = []
+    for spec in (spec_1, spec_2):
+        agent_type, _ = tournament.parse_agent_spec(spec)
+        if agent_type == 'nstep':
+            spec += (',' if ':' in spec else ':') + 'cache_path={0}'.format(path)
+        specs.append(spec)
+    return tournament.run_tournament(specs[0], specs[1], num_games, workers=workers, seed=seed, rows=rows, cols=cols,
+                                     k=k)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage a persistent position cache for NStepAgent.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    warmup_parser = subparsers.add_parser('warmup', help='fill the cache by playing a tournament')
+    warmup_parser.add_argument('path', help='cache file')
+    warmup_parser.add_argument('agent_1', help='first agent, e.g. nstep:nsteps=4')
+    warmup_parser.add_argument('agent_2', help='second agent, in the same format')
+    warmup_parser.add_argument('--games', type=int, default=100)
+    warmup_parser.add_argument('--workers', type=int, default=None)
+    warmup_parser.add_argument('--seed', type=int, default=0)
+    warmup_parser.add_argument('--rows', type=int, default=3)
+    warmup_parser.add_argument('--cols', type=int, default=3)
+    warmup_parser.add_argument('--k', type=int, default=3)
+    stats_parser = subparsers.add_parser('stats', help='show the number of cached positions')
+    stats_parser.add_argument('path', help='cache file')
+    args = parser.parse_args(argv)
+
+    if args.command == 'warmup':
+        report = warm_up(args.path, args.agent_1, args.agent_2, args.games, args.workers, args.seed, args.rows,
+                         args.cols, args.k)
+        print('played {0} games in {1:.1f} s'.format(report['games'], report['seconds']))
+    for space, count in cache_statistics(args.path).items():
+        print('{0}: {1} positions'.format(space, count))
+
+
+if __name__ == '__main__':
+    main()
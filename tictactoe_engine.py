@@ -5,7 +5,8 @@ First create simple data structures that hold the game state, then encapsulate t
 print out the game state after every move
 """
 
-import tictactoe_agents as ta
+import functools
+import random
 
 """
 This is what we want to accomplish eventually:
@@ -16,18 +17,211 @@ while True:
 """
 
 
+class BoardGeometry:
+    """
+    Precomputed tables for an m,n,k board: rows x cols squares, where k pieces in a row wins.
+    Square (row, col) has index cols * row + col, and bit number index of a player's bitboard is set
+    when that player occupies the square.
+    Boards of the same size share one instance, see get_geometry.
+    """
+    DIRECTIONS = ((0, 1), (1, 0), (1, 1), (1, -1))  # rows, columns, diagonals, anti-diagonals
+    MAX_TABLE_BITS = 12  # boards up to this many squares transform in a single table lookup
+    HASH_BITS = 64
+
+    def __init__(self, rows, cols, k):
+        if rows < 1 or cols < 1:
+            raise ValueError('the board needs at least one row and one column')
+        if k < 1 or k > max(rows, cols):
+            raise ValueError('k must be between 1 and the length of the longest side of the board')
+
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.num_squares = rows * cols
+        self.squares = tuple((row, col) for row in range(0, rows) for col in range(0, cols))
+        self.full_board = (1 << self.num_squares) - 1
+
+        # every run of k squares in a straight line, as a bitmask
+        lines = []
+        for row_step, col_step in self.DIRECTIONS:
+            for row, col in self.squares:
+                end_row, end_col = row + (k - 1) * row_step, col + (k - 1) * col_step
+                if 0 <= end_row < rows and 0 <= end_col < cols:
+                    lines.append(sum(1 << (cols * (row + i * row_step) + col + i * col_step) for i in range(0, k)))
+        self.lines = tuple(lines)
+        # lines_through[index] holds the lines containing square index; only those can be completed by a move there
+        self.lines_through = tuple(tuple(line for line in self.lines if line >> index & 1)
+                                   for index in range(0, self.num_squares))
+
+        self.symmetries = self._symmetries()
+        # the symmetries are applied to a bitboard a chunk of bits at a time:
+        # _symmetry_tables[s][c][bits] is the image under symmetry s of bits placed at chunk c
+        self._chunk_bits = self.num_squares if self.num_squares <= self.MAX_TABLE_BITS else 8
+        self._chunk_mask = (1 << self._chunk_bits) - 1
+        num_chunks = -(-self.num_squares // self._chunk_bits)
+        self._symmetry_tables = tuple(
+            tuple(tuple(self._permute(bits << (chunk * self._chunk_bits), permutation)
+                        for bits in range(0, self._chunk_mask + 1))
+                  for chunk in range(0, num_chunks))
+            for permutation in self.symmetries)
+        self._single_tables = tuple(tables[0] for tables in self._symmetry_tables) if num_chunks == 1 else None
+        self._neighbourhoods = {}
+        self._init_zobrist()
+
+    def _init_zobrist(self):
+        """
+        draws the random keys for Zobrist hashing: one 64-bit key per player per square, and one for the side to move.
+        The keys are drawn from a generator seeded by the board size, so every process computes the same hashes.
+
+        GameBoard keeps the hash of the position and of every symmetric variant of it packed into one integer,
+        HASH_BITS bits per symmetry, so a single XOR updates them all. zobrist_keys[player][index] holds the packed
+        keys for a piece of player on square index: in the bits of symmetry s, the key of the square it maps to.
+        """
+        generator = random.Random('zobrist {0}x{1}'.format(self.rows, self.cols))
+        piece_keys = [[generator.getrandbits(self.HASH_BITS) for _ in range(0, self.num_squares)] for _ in (0, 1)]
+        side_key = generator.getrandbits(self.HASH_BITS)
+
+        self.hash_mask = (1 << self.HASH_BITS) - 1
+        self.zobrist_keys = tuple(
+            tuple(sum(piece_keys[player][permutation[index]] << (self.HASH_BITS * symmetry)
+                      for symmetry, permutation in enumerate(self.symmetries))
+                  for index in range(0, self.num_squares))
+            for player in (0, 1))
+        self.zobrist_side_key = sum(side_key << (self.HASH_BITS * symmetry)
+                                    for symmetry in range(0, len(self.symmetries)))
+
+    def _symmetries(self):
+        """the rotations and reflections that map the board onto itself, each as a tuple of square images"""
+        transforms = [lambda r, c: (r, c),
+                      lambda r, c: (self.rows - 1 - r, c),
+                      lambda r, c: (r, self.cols - 1 - c),
+                      lambda r, c: (self.rows - 1 - r, self.cols - 1 - c)]
+        if self.rows == self.cols:
+            # square boards can also be transposed, which together with the above gives all 8 symmetries
+            transforms += [lambda r, c: (c, r),
+                           lambda r, c: (self.cols - 1 - c, r),
+                           lambda r, c: (c, self.rows - 1 - r),
+                           lambda r, c: (self.cols - 1 - c, self.rows - 1 - r)]
+
+        permutations = []
+        for transform in transforms:
+            permutation = []
+            for row, col in self.squares:
+                image_row, image_col = transform(row, col)
+                permutation.append(self.cols * image_row + image_col)
+            permutations.append(tuple(permutation))
+        return tuple(permutations)
+
+    def _permute(self, bits, permutation):
+        """applies a permutation of the squares to a bitboard, one bit at a time"""
+        result = 0
+        for index in range(0, self.num_squares):
+            if bits >> index & 1:
+                result |= 1 << permutation[index]
+        return result
+
+    def transform(self, bits, symmetry):
+        """returns the bitboard bits after applying self.symmetries[symmetry]"""
+        result = 0
+        shift = 0
+        for table in self._symmetry_tables[symmetry]:
+            result |= table[bits >> shift & self._chunk_mask]
+            shift += self._chunk_bits
+        return result
+
+    def canonical_key(self, x_bits, o_bits):
+        """the smallest key among all symmetric variants of the position given by the two bitboards"""
+        if self._single_tables is not None:
+            return min(table[x_bits] | table[o_bits] << self.num_squares for table in self._single_tables)
+        return min(self.transform(x_bits, symmetry) | self.transform(o_bits, symmetry) << self.num_squares
+                   for symmetry in range(0, len(self.symmetries)))
+
+    def neighbourhood_masks(self, radius):
+        """for every square, the mask of squares at most radius rows and columns away from it"""
+        if radius not in self._neighbourhoods:
+            masks = []
+            for row, col in self.squares:
+                masks.append(sum(1 << index for index, (other_row, other_col) in enumerate(self.squares)
+                                 if abs(other_row - row) <= radius and abs(other_col - col) <= radius))
+            self._neighbourhoods[radius] = tuple(masks)
+        return self._neighbourhoods[radius]
+
+
+@functools.lru_cache(maxsize=None)
+def get_geometry(rows=3, cols=3, k=3):
+    """returns the shared BoardGeometry for a rows x cols board with k in a row to win"""
+    return BoardGeometry(rows, cols, k)
+
+
 class GameBoard:
     """
-    This class represents the game board of a game of Tic Tac Toe.
+    This class represents the game board of a game of Tic Tac Toe, or more generally of an m,n,k-game:
+    rows x cols squares where the first player to get k pieces in a row, column or diagonal wins.
     It allows players to make moves and to check whether the game is over.
+
+    The position is stored as two integers, one per player, in self.bitboards.
+    The list-of-rows view in self.board is derived from those on demand.
     """
 
-    def __init__(self):
-        self.board = [['.', '.', '.'], ['.', '.', '.'], ['.', '.', '.']]  # a list of rows
+    def __init__(self, rows=3, cols=3, k=3):
+        self.geometry = get_geometry(rows, cols, k)
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.num_squares = rows * cols
+        self.bitboards = [0, 0]
         self.pieces = ['X', 'O']
         self.moves = []
         self.active_player = 0
         self.winner = -1
+        self._winner_history = []  # the value of self.winner before each move in self.moves
+        self._hashes = 0  # the Zobrist hashes of the position under every symmetry, see BoardGeometry._init_zobrist
+
+    @property
+    def board(self):
+        """a list of rows holding 'X', 'O' or '.' for every square"""
+        x_bits, o_bits = self.bitboards
+        board = []
+        for row in range(0, self.rows):
+            board_row = []
+            for col in range(0, self.cols):
+                bit = 1 << (self.cols * row + col)
+                if x_bits & bit:
+                    board_row.append(self.pieces[0])
+                elif o_bits & bit:
+                    board_row.append(self.pieces[1])
+                else:
+                    board_row.append('.')
+            board.append(board_row)
+        return board
+
+    @property
+    def zobrist_hash(self):
+        """a 64-bit hash of the pieces on the board and the player to move, updated with every move"""
+        return self._hashes & self.geometry.hash_mask
+
+    @property
+    def symmetric_hashes(self):
+        """the Zobrist hashes of the position after each of the board's symmetries, starting with the identity"""
+        hash_bits = self.geometry.HASH_BITS
+        mask = self.geometry.hash_mask
+        return tuple(self._hashes >> (hash_bits * symmetry) & mask
+                     for symmetry in range(0, len(self.geometry.symmetries)))
+
+    @property
+    def canonical_hash(self):
+        """
+        the smallest of symmetric_hashes: all rotations and reflections of a position share it, which makes it the key
+        to cache positions by. Unlike canonical_key it costs the same on every board size
+        """
+        return min(self.symmetric_hashes)
+
+    def canonical_key(self):
+        """
+        returns an integer identifying the position up to rotation and reflection: all symmetric variants
+        of a position share the same key. The player to move follows from the number of pieces on the board.
+        """
+        return self.geometry.canonical_key(self.bitboards[0], self.bitboards[1])
 
     def print_board(self):
         """prints the current state of the game"""
@@ -41,68 +235,77 @@ class GameBoard:
         if player < 0 or player > 1:
             raise ValueError('player must be 0 or 1')
 
-        if row < 0 or row > 2 or col < 0 or col > 2:
-            print('\nWarning: the proposed move is illegal - please specify row and column in the range 1-3.\n')
-        elif self.board[row][col] == '.':
-            self.board[row][col] = self.pieces[player]
+        if row < 0 or row >= self.rows or col < 0 or col >= self.cols:
+            print('\nWarning: the proposed move is illegal - please specify row in the range 1-{0} '
+                  'and column in the range 1-{1}.\n'.format(self.rows, self.cols))
+            return
+
+        index = self.cols * row + col
+        bit = 1 << index
+        if (self.bitboards[0] | self.bitboards[1]) & bit:
+            print('\nWarning: the proposed move is illegal - that field is already occupied. No move has been made.\n')
+        else:
+            self.bitboards[player] |= bit
             self.moves.append((row, col, player))
+            self._winner_history.append(self.winner)
             self.active_player = 1 - self.active_player
-        else:
-            print('\nWarning: the proposed move is illegal - that field is already occupied. No move has been made.\n')
+            self._hashes ^= self.geometry.zobrist_keys[player][index] ^ self.geometry.zobrist_side_key
+
+            # only lines through the new piece can have been completed by it
+            if self.winner == -1:
+                player_bits = self.bitboards[player]
+                for line in self.geometry.lines_through[index]:
+                    if player_bits & line == line:
+                        self.winner = player
+                        break
+
+    def undo_move(self):
+        """
+        takes back the last move made with place_piece, restoring the pieces, active_player and winner
+        to exactly what they were before that move. Lets the agents search in place instead of copying the board.
+        """
+        if not self.moves:
+            raise ValueError('there is no move to undo')
+
+        row, col, player = self.moves.pop()
+        index = self.cols * row + col
+        self.bitboards[player] &= ~(1 << index)
+        self.winner = self._winner_history.pop()
+        self.active_player = 1 - self.active_player
+        self._hashes ^= self.geometry.zobrist_keys[player][index] ^ self.geometry.zobrist_side_key
 
     def get_legal_moves(self):
         """
-        Returns a list of legal moves. Those moves are precisely the board entries that have a '.'
+        Returns a list of legal moves. Those moves are precisely the squares that neither player occupies
         """
-        empty_space_loc = []
-        for i in range(0, 3):
-            for j in range(0, 3):
-                if self.board[i][j] == '.':
-                    empty_space_loc.append((i, j))
+        occupied = self.bitboards[0] | self.bitboards[1]
+        return [square for index, square in enumerate(self.geometry.squares) if not occupied >> index & 1]
 
-        return empty_space_loc
+    def get_nearby_moves(self, radius=1):
+        """
+        Returns the legal moves at most radius rows and columns away from a piece on the board, or the center
+        square if the board is empty. On large boards these are the only moves worth searching.
+        """
+        if not self.moves:
+            return [(self.rows // 2, self.cols // 2)]
+
+        masks = self.geometry.neighbourhood_masks(radius)
+        nearby = 0
+        for row, col, _ in self.moves:
+            nearby |= masks[self.cols * row + col]
+        nearby &= ~(self.bitboards[0] | self.bitboards[1])
+        return [square for index, square in enumerate(self.geometry.squares) if nearby >> index & 1]
 
     def game_end(self):
         """
         checks to see if any player has won or if the game is drawn
-        # check for rows
+        the winner itself is already determined by place_piece
         """
-        row_player_1 = [row.count('X') for row in self.board]
-        if row_player_1.count(3) > 0:
-            self.winner = 0
-            return True
-        row_player_2 = [row.count('O') for row in self.board]
-        if row_player_2.count(3) > 0:
-            self.winner = 1
-            return True
-
-        # check for columns
-        cols = [[row[i] for row in self.board] for i in range(0, 3)]
-        col_player_1 = [col.count('X') for col in cols]
-        if col_player_1.count(3) > 0:
-            self.winner = 0
-            return True
-        col_player_2 = [col.count('O') for col in cols]
-        if col_player_2.count(3) > 0:
-            self.winner = 1
-            return True
-
-        # check for diagonals
-        diags = [[self.board[i][i] for i in range(0, 3)], [self.board[j][2 - j] for j in range(0, 3)]]
-        diag_player_1 = [diag.count('X') for diag in diags]
-        if diag_player_1.count(3) > 0:
-            self.winner = 0
-            return True
-        diag_player_2 = [diag.count('O') for diag in diags]
-        if diag_player_2.count(3) > 0:
-            self.winner = 1
+        if self.winner != -1:
             return True
 
         # At this point, there is no winner - now check if any valid moves can still be made
-        if len(self.moves) >= 9:
-            return True
-        # If we reached this point then none of the game-end conditions have been met
-        return False
+        return self.bitboards[0] | self.bitboards[1] == self.geometry.full_board
 
 
 class TicTacToe:
@@ -111,29 +314,46 @@ class TicTacToe:
     It contains options for using Agents or for players to play against one another.
     """
 
-    def __init__(self, agent_1, agent_2):
-        self.game_board = GameBoard()
+    def __init__(self, agent_1, agent_2, rows=3, cols=3, k=3, verbose=True, recorder=None):
+        """
+        with verbose=False the game is played without printing the board or the result.
+        A recorder, such as a tictactoe_records.GameRecordWriter, gets the board of the game when it has ended
+        """
+        self.game_board = GameBoard(rows=rows, cols=cols, k=k)
         self.agents = [agent_1, agent_2]
+        self.verbose = verbose
+        self.recorder = recorder
 
     def play_game(self):
+        """plays the game to the end and returns the winner: 0 or 1, or -1 for a draw"""
+        for agent in self.agents:
+            agent.new_game()
+
         while not self.game_board.game_end():
-            print('Current board position:\n')
-            self.game_board.print_board()
+            if self.verbose:
+                print('Current board position:\n')
+                self.game_board.print_board()
             move_row, move_col = self.agents[self.game_board.active_player].make_move(self.game_board)
             self.game_board.place_piece(row=move_row, col=move_col, player=self.game_board.active_player)
 
-        print('===========')
-        print('Game over!')
-        print('===========\n')
-        if self.game_board.winner == -1:
-            print('The game ended in a draw\n')
-        else:
-            print('Congratulations, {0}!\n'.format(self.agents[self.game_board.winner].name))
-        print('Final board position:')
-        self.game_board.print_board()
+        if self.verbose:
+            print('===========')
+            print('Game over!')
+            print('===========\n')
+            if self.game_board.winner == -1:
+                print('The game ended in a draw\n')
+            else:
+                print('Congratulations, {0}!\n'.format(self.agents[self.game_board.winner].name))
+            print('Final board position:')
+            self.game_board.print_board()
+        if self.recorder is not None:
+            self.recorder.record(self.game_board)
+        return self.game_board.winner
 
 
 if __name__ == '__main__':
+    import tictactoe_agents as ta  # imported here because the agents themselves depend on this module
+
     print('The game has begun!')
     player_1_agent = ta.HumanAgent('Human Player')
     player_2_agent = ta.NStepAgent()
@@ -1,28 +1,64 @@
 """
-THIS IS STILL A WORK IN PROGRESS AND IS CURRENTLY NOT WORKING. TO RUN TICTACTOE JUST RUN THE play.py FILE.
+A graphical front-end for tic tac toe. Click a square to play your move; the computer searches in a background
+thread so the window stays responsive, showing how many positions it has searched so far.
+
+Example:
+    python tictactoe_gui.py --opponent nstep
+    python tictactoe_gui.py --rows 7 --cols 7 --k 4 --opponent nstep:nsteps=2,move_radius=1
 """
 
+import argparse
+import queue
+import threading
+import time
+import tkinter as tk
 
+import tictactoe_engine as te
+import tournament
 
-import tkinter as tk
+POLL_INTERVAL_MS = 50  # how often the window checks on the computer's search
 
 
 class Game(tk.Frame):
+    """
+    A window playing games between the players in agents, where None stands for the human clicking the board.
+    The game itself is a TicTacToe from the engine; the window drives it one move at a time.
+    """
 
-    def __init__(self, master):
+    def __init__(self, master, agents=(None, None), rows=3, cols=3, k=3, size=600):
         super(Game, self).__init__(master)
-        self.width = 800
-        self.height = 800
-        self.canvas = tk.Canvas(self, bg='#aabbff', width=self.width, height=self.height)
-        self.draw_board()
+        self.agents = list(agents)
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.square_size = size / max(rows, cols)
+        self.width = self.square_size * cols
+        self.height = self.square_size * rows
+
+        self.canvas = tk.Canvas(self, bg='#aabbff', width=self.width, height=self.height, highlightthickness=0)
+        self.canvas.bind('<Button-1>', self.on_click)
         self.canvas.pack()
+        self.status = tk.Label(self, anchor='w', font=('TkDefaultFont', 12))
+        self.status.pack(fill='x')
+        buttons = tk.Frame(self)
+        buttons.pack(fill='x')
+        tk.Button(buttons, text='New game', command=self.request_new_game).pack(side='left')
+        tk.Button(buttons, text='Swap sides', command=self.swap_sides).pack(side='left')
+        self.draw_board()
         self.pack()
-        self.pieces = []
-        self.add_piece(1, 1, 1)
+
+        self.game = None
+        self.pieces = {}  # square index -> the PlayerPiece drawn there
+        self.results = queue.Queue()  # (game number, move) from the search thread
+        self.search = None  # (thread, agent, start time) while the computer is thinking
+        self.game_number = 0
+        self.new_game_requested = False
+        self.new_game()
+        self.after(POLL_INTERVAL_MS, self.poll)
 
     def draw_board(self):
-        x_pos = [(self.width / 3) * i for i in [1, 2]]
-        y_pos = [(self.height / 3) * i for i in [1, 2]]
+        x_pos = [self.square_size * i for i in range(1, self.cols)]
+        y_pos = [self.square_size * i for i in range(1, self.rows)]
 
         for x in x_pos:
             self.canvas.create_line(x, 0, x, self.height, width=2.0, fill='black')
@@ -30,15 +66,125 @@ class Game(tk.Frame):
         for y in y_pos:
             self.canvas.create_line(0, y, self.width, y, width=2.0, fill='black')
 
+    @property
+    def board(self):
+        return self.game.game_board
+
+    def request_new_game(self):
+        """starts a new game, or, while the computer is thinking, as soon as it has made its move"""
+        if self.search is not None:
+            self.new_game_requested = True
+            self.status.config(text='A new game starts when the computer has finished thinking')
+        else:
+            self.new_game()
+
+    def swap_sides(self):
+        self.agents.reverse()
+        self.request_new_game()
+
+    def new_game(self):
+        self.new_game_requested = False
+        self.game_number += 1
+        self.game = te.TicTacToe(self.agents[0], self.agents[1], rows=self.rows, cols=self.cols, k=self.k,
+                                 verbose=False)
+        for agent in self.agents:
+            if agent is not None:
+                agent.new_game()
+        self.redraw()
+        self.next_turn()
+
+    def on_click(self, event):
+        if self.search is not None or self.board.game_end() or self.agents[self.board.active_player] is not None:
+            return
+        move = (int(event.y // self.square_size), int(event.x // self.square_size))
+        if move in self.board.get_legal_moves():
+            self.play(move)
+
+    def play(self, move):
+        self.board.place_piece(row=move[0], col=move[1], player=self.board.active_player)
+        self.redraw()
+        self.next_turn()
+
+    def next_turn(self):
+        """starts the computer's search if it is to move, and otherwise shows whose turn it is or the result"""
+        board = self.board
+        if board.game_end():
+            if board.winner == -1:
+                self.status.config(text='The game ended in a draw')
+            else:
+                self.status.config(text='{0} won!'.format(self.player_name(board.winner)))
+            return
+
+        agent = self.agents[board.active_player]
+        if agent is None:
+            self.status.config(text='{0} to move'.format(self.player_name(board.active_player)))
+            return
+
+        # the search places and takes back pieces on the board it is given, so it gets a copy of its own
+        position = te.GameBoard(rows=board.rows, cols=board.cols, k=board.k)
+        for move_row, move_col, player in board.moves:
+            position.place_piece(row=move_row, col=move_col, player=player)
+        thread = threading.Thread(target=self.think, args=(agent, position, self.game_number), daemon=True)
+        self.search = (thread, agent, time.perf_counter())
+        thread.start()
+
+    def think(self, agent, position, game_number):
+        """runs in the search thread; hands the move over to the Tk thread through self.results"""
+        try:
+            move = agent.make_move(position)
+        except Exception as error:
+            move = error
+        self.results.put((game_number, move))
+
+    def poll(self):
+        """checks on the search every POLL_INTERVAL_MS: plays its move when it is done, else updates the status"""
+        if self.search is not None:
+            try:
+                game_number, move = self.results.get_nowait()
+            except queue.Empty:
+                _, agent, start = self.search
+                text = '{0} is thinking... {1:.1f} s'.format(agent.name, time.perf_counter() - start)
+                node_count = getattr(agent, 'node_count', None)
+                if node_count is not None:
+                    text += ', {0:,} positions searched'.format(node_count)
+                self.status.config(text=text)
+            else:
+                self.search = None
+                if self.new_game_requested:
+                    self.new_game()
+                elif isinstance(move, Exception):
+                    self.status.config(text='The computer failed: {0}'.format(move))
+                elif game_number == self.game_number:
+                    self.play(move)
+        self.after(POLL_INTERVAL_MS, self.poll)
+
+    def player_name(self, player):
+        agent = self.agents[player]
+        name = agent.name if agent is not None else 'You'
+        return '{0} ({1})'.format(name, self.board.pieces[player])
+
+    def redraw(self):
+        """brings the pieces on the canvas in line with the board, touching only the squares that changed"""
+        for index, (row, col) in enumerate(self.board.geometry.squares):
+            bit = 1 << index
+            player = 0 if self.board.bitboards[0] & bit else 1 if self.board.bitboards[1] & bit else None
+            piece = self.pieces.get(index)
+            if piece is not None and piece.player != player:
+                piece.delete()
+                del self.pieces[index]
+                piece = None
+            if piece is None and player is not None:
+                self.add_piece(player, col, row)
+
     def add_piece(self, player, x_loc, y_loc):
-        piece = PlayerPiece(self.canvas, player, x_loc, y_loc)
-        self.pieces.append(piece)
+        piece = PlayerPiece(self.canvas, player, x_loc, y_loc, self.square_size)
+        self.pieces[self.cols * y_loc + x_loc] = piece
 
 
 class GameObject:
-    def __init__(self, canvas, item, x_loc, y_loc):
+    def __init__(self, canvas, items, x_loc, y_loc):
         self.canvas = canvas
-        self.item = item
+        self.items = items
         self.x_loc = x_loc
         self.y_loc = y_loc
 
@@ -46,43 +192,58 @@ class GameObject:
         return self.x_loc, self.y_loc
 
     def delete(self):
-        self.canvas.delete(self.item)
+        for item in self.items:
+            self.canvas.delete(item)
 
 
 class PlayerPiece(GameObject):
     """
     player is the player who places the piece (0 or 1)
-    x_loc is the x location of the piece (0, 1, 2)
-    y_loc is the y location of the piece (0, 1, 2)
+    x_loc is the column of the piece and y_loc its row, counting from 0
+    square_size is the width and height of a square on the canvas
     """
 
-    def __init__(self, canvas, player, x_loc, y_loc):
-        square_height = canvas.winfo_height() / 3
-        square_width = canvas.winfo_width() / 3
-        self.height = square_height * 0.8
-        self.width = square_width * 0.8
+    def __init__(self, canvas, player, x_loc, y_loc, square_size):
+        left = (x_loc + 0.1) * square_size
+        top = (y_loc + 0.1) * square_size
+        right = (x_loc + 0.9) * square_size
+        bottom = (y_loc + 0.9) * square_size
+        line_width = max(2.0, square_size / 15)
 
         if player == 0:
-            item = 1
             # player 1 plays 'X'
-
-            #item = canvas.create_line()
+            items = (canvas.create_line(left, top, right, bottom, width=line_width, fill='black'),
+                     canvas.create_line(left, bottom, right, top, width=line_width, fill='black'))
         elif player == 1:
             # player 2 plays 'O'
-            item = canvas.create_oval((x_loc + 0.1) * square_width,
-                                      (y_loc + 0.1) * square_height,
-                                      (x_loc + 0.9) * square_width,
-                                      (y_loc + 0.9) * square_height,
-                                      fill='white')
+            items = (canvas.create_oval(left, top, right, bottom, width=line_width, outline='black', fill='white'),)
         else:
             raise ValueError('player must be 0 or 1')
 
-        super(PlayerPiece, self).__init__(canvas, item, x_loc, y_loc)
+        self.player = player
+        super(PlayerPiece, self).__init__(canvas, items, x_loc, y_loc)
 
 
-if __name__ == '__main__':
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play tic tac toe against the computer in a window.')
+    parser.add_argument('--opponent', default='nstep',
+                        help='computer player as in tournament.py, e.g. nstep:nsteps=4, or human for two players')
+    parser.add_argument('--computer-first', action='store_true', help='let the computer play X')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3, help='number of pieces in a row needed to win')
+    args = parser.parse_args(argv)
+
+    opponent = None
+    if args.opponent != 'human':
+        opponent = tournament.build_agent(args.opponent)
+    agents = (opponent, None) if args.computer_first else (None, opponent)
+
     root = tk.Tk()
     root.title('TicTacToe!')
-    game = Game(root)
+    game = Game(root, agents, rows=args.rows, cols=args.cols, k=args.k)
     game.mainloop()
 
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,299 @@
+"""
+Learns the value of positions from self-play
+
+The value of a position is the expected result for the player who moved into it (1 for a win, 0 for a draw, -1 for a
+loss), learned by Monte Carlo or TD(0) updates from games the current values play against themselves. Positions are
+keyed by their canonical Zobrist hash, so all rotations and reflections of a position share one value.
+Games are played in batches by a pool of processes, and the updates of a batch are averaged per position and
+applied together. The pool processes get the values once when they start and after that only the changes of the
+batches they have not seen, so a batch does not cost more as the table grows.
+
+The trained values are exported as a ValueTable: an open-addressing hash table stored in two flat arrays, which
+LearnedAgent loads with a single read and looks up in constant time.
+
+Run this file to train a table, e.g.:
+    python tictactoe_learning.py --batches 50 --games 2000 --workers 4
+    python tictactoe_learning.py --rows 5 --cols 5 --k 4 --move-radius 1 --batches 200
+"""
+
+import argparse
+import os
+import random
+import struct
+import time
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+
+import tictactoe_engine as te
+
+MAGIC = b'TTTV'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBBQ')  # magic, version, rows, cols, k, capacity
+VALUE_SCALE = 32767  # values are stored as 16-bit integers, value * VALUE_SCALE
+
+_worker_values = None  # the values a pool process plays its training games with
+_worker_version = 0  # the number of batches whose changes _worker_values includes
+
+
+def value_table_path(rows=3, cols=3, k=3):
+    """the default place of the value table for a board size, next to this module"""
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        'tictactoe_values_{0}x{1}x{2}.bin'.format(rows, cols, k))
+
+
+class ValueTable:
+    """
+    Position values by canonical hash, stored in an open-addressing hash table with linear probing: keys holds the
+    hashes, with 0 marking an empty slot, and values the values scaled to 16-bit integers.
+    The capacity is a power of two at least twice the number of positions, so a lookup probes few slots.
+    """
+
+    def __init__(self, rows, cols, k, keys, values):
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.keys = keys
+        self.values = values
+        self._mask = len(keys) - 1
+
+    @classmethod
+    def from_dict(cls, values, rows=3, cols=3, k=3):
+        """builds the table from a dict of canonical hash -> value"""
+        capacity = 1
+        while capacity < 2 * len(values):
+            capacity *= 2
+        keys = array('Q', bytes(8 * capacity))
+        scaled = array('h', bytes(2 * capacity))
+        mask = capacity - 1
+        for key, value in values.items():
+            if key == 0:
+                continue  # only the empty board hashes to 0, and nobody moves into it
+            slot = key & mask
+            while keys[slot]:
+                slot = (slot + 1) & mask
+            keys[slot] = key
+            scaled[slot] = round(max(-1.0, min(1.0, value)) * VALUE_SCALE)
+        return cls(rows, cols, k, keys, scaled)
+
+    def __len__(self):
+        return sum(1 for key in self.keys if key)
+
+    def get(self, key, default=None):
+        """the value stored for a canonical hash, or default"""
+        keys = self.keys
+        slot = key & self._mask
+        while True:
+            stored = keys[slot]
+            if stored == key:
+                return self.values[slot] / VALUE_SCALE
+            if not stored:
+                return default
+            slot = (slot + 1) & self._mask
+
+    def save(self, path):
+        with open(path, 'wb') as table_file:
+            table_file.write(HEADER.pack(MAGIC, VERSION, self.rows, self.cols, self.k, len(self.keys)) +
+                             self.keys.tobytes() + self.values.tobytes())
+
+    @classmethod
+    def load(cls, path):
+        """reads a table written by save, with a single read of the file"""
+        with open(path, 'rb') as table_file:
+            data = memoryview(table_file.read())
+        magic, version, rows, cols, k, capacity = HEADER.unpack_from(data)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError('{0} is not a value table'.format(path))
+        keys = array('Q')
+        keys.frombytes(data[HEADER.size:HEADER.size + 8 * capacity])
+        values = array('h')
+        values.frombytes(data[HEADER.size + 8 * capacity:HEADER.size + 10 * capacity])
+        return cls(rows, cols, k, keys, values)
+
+
+def candidate_moves(board, move_radius=None):
+    return board.get_legal_moves() if move_radius is None else board.get_nearby_moves(move_radius)
+
+
+def move_values(board, values, moves):
+    """the value of the position after each of moves for the player to move, from values (a dict or ValueTable)"""
+    scores = []
+    player = board.active_player
+    for move_row, move_col in moves:
+        board.place_piece(row=move_row, col=move_col, player=player)
+        if board.winner == player:
+            scores.append(1.0)
+        elif board.game_end():
+            scores.append(0.0)
+        else:
+            scores.append(values.get(board.canonical_hash, 0.0))
+        board.undo_move()
+    return scores
+
+
+def play_training_games(values, num_games, epsilon, seed, rows=3, cols=3, k=3, move_radius=None):
+    """
+    plays num_games games in which both players pick the move with the best value, or with probability epsilon a
+    random one. Returns every game as (the canonical hashes of the positions after each move, the winner).
+    Runs in a pool process.
+    """
+    rng = random.Random(seed)
+    games = []
+    for _ in range(0, num_games):
+        board = te.GameBoard(rows=rows, cols=cols, k=k)
+        hashes = []
+        while not board.game_end():
+            moves = candidate_moves(board, move_radius)
+            if rng.random() < epsilon:
+                move = rng.choice(moves)
+            else:
+                scores = move_values(board, values, moves)
+                best_score = max(scores)
+                move = rng.choice([move for move, score in zip(moves, scores) if score == best_score])
+            board.place_piece(row=move[0], col=move[1], player=board.active_player)
+            hashes.append(board.canonical_hash)
+        games.append((hashes, board.winner))
+    return games
+
+
+def init_training_worker(values):
+    """starts a pool process with the values before the first batch"""
+    global _worker_values, _worker_version
+    _worker_values = values
+    _worker_version = 0
+
+
+def play_training_batch(batch, first_version, changes, num_games, epsilon, seed, rows=3, cols=3, k=3,
+                        move_radius=None):
+    """
+    plays the games of a task of batch in a pool process: first brings the process's values up to date with changes,
+    the changes of the batches from first_version on, skipping those it has already seen, then calls
+    play_training_games. Returns the process id, so the caller can tell which version each process is at, and the games
+    """
+    global _worker_version
+    for version, batch_changes in enumerate(changes, first_version):
+        if version >= _worker_version:
+            _worker_values.update(batch_changes)
+    _worker_version = batch
+    return os.getpid(), play_training_games(_worker_values, num_games, epsilon, seed, rows, cols, k, move_radius)
+
+
+def batch_updates(values, games, method='mc'):
+    """
+    the average target per position over games, for the positions they visited.
+    With method 'mc' the target is the result of the game for the player who moved into the position; with 'td'
+    it is the negated current value of the position after the reply, or the result if there was no reply.
+    """
+    totals = {}
+    for hashes, winner in games:
+        for i, key in enumerate(hashes):
+            mover = i % 2
+            result = 0.0 if winner == -1 else 1.0 if winner == mover else -1.0
+            if method == 'td' and i + 1 < len(hashes):
+                target = -values.get(hashes[i + 1], 0.0)
+            else:
+                target = result
+            total = totals.get(key)
+            if total is None:
+                totals[key] = [target, 1]
+            else:
+                total[0] += target
+                total[1] += 1
+    return {key: total / count for key, (total, count) in totals.items()}
+
+
+def train(batches=50, games_per_batch=2000, workers=None, learning_rate=0.2, epsilon=(0.3, 0.05), method='mc',
+          rows=3, cols=3, k=3, move_radius=None, seed=0, values=None, verbose=True):
+    """
+    trains position values by self-play and returns them as a dict of canonical hash -> value.
+    Every batch the games are split over workers processes; epsilon decays linearly from its first to its second
+    value over the batches. Each position's value moves learning_rate of the way to its average target in the batch.
+    """
+    if method not in ('mc', 'td'):
+        raise ValueError('method must be mc or td')
+    values = {} if values is None else values
+    num_tasks = max(1, workers or 1)
+    pool = None
+    if workers and workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers, initializer=init_training_worker, initargs=(dict(values),))
+    worker_versions = {}  # process id -> the batch the process played its last games for
+    changes = {}  # batch -> the values that changed after it, kept until every process has seen them
+    try:
+        for batch in range(0, batches):
+            start = time.perf_counter()
+            batch_epsilon = epsilon[0] + (epsilon[1] - epsilon[0]) * batch / max(1, batches - 1)
+            sizes = [games_per_batch // num_tasks + (i < games_per_batch % num_tasks) for i in range(0, num_tasks)]
+            seeds = [(seed * batches + batch) * num_tasks + i for i in range(0, num_tasks)]
+            if pool is None:
+                results = [play_training_games(values, size, batch_epsilon, task_seed, rows, cols, k, move_radius)
+                           for size, task_seed in zip(sizes, seeds)]
+            else:
+                # a process that has not played yet still has the values it started with
+                first_version = min(worker_versions.values()) if len(worker_versions) == workers else 0
+                for version in [version for version in changes if version < first_version]:
+                    del changes[version]
+                batch_changes = [changes[version] for version in range(first_version, batch)]
+                futures = [pool.submit(play_training_batch, batch, first_version, batch_changes, size, batch_epsilon,
+                                       task_seed, rows, cols, k, move_radius) for size, task_seed in zip(sizes, seeds)]
+                results = []
+                for future in futures:
+                    pid, task_games = future.result()
+                    worker_versions[pid] = batch
+                    results.append(task_games)
+
+            games = [game for task_games in results for game in task_games]
+            changed = {}
+            for key, target in batch_updates(values, games, method).items():
+                value = values.get(key, 0.0)
+                changed[key] = values[key] = value + learning_rate * (target - value)
+            if pool is not None:
+                changes[batch] = changed
+            if verbose:
+                x_wins = sum(winner == 0 for _, winner in games)
+                draws = sum(winner == -1 for _, winner in games)
+                print('batch {0}: {1} positions, X won {2}, drew {3} of {4} games, {5:.2f} s'.format(
+                    batch + 1, len(values), x_wins, draws, len(games), time.perf_counter() - start))
+    finally:
+        if pool is not None:
+            pool.shutdown()
+    return values
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Train a value table for LearnedAgent by self-play.')
+    parser.add_argument('--batches', type=int, default=50)
+    parser.add_argument('--games', type=int, default=2000, help='games per batch')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes to play the games in')
+    parser.add_argument('--learning-rate', type=float, default=0.2)
+    parser.add_argument('--method', choices=['mc', 'td'], default='mc')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3, help='number of pieces in a row needed to win')
+    parser.add_argument('--move-radius', type=int, default=None, help='only consider moves near earlier pieces')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default=None, help='file to write the table to (default: next to this module)')
+    parser.add_argument('--evaluate', type=int, default=200, help='games to play against other agents afterwards')
+    args = parser.parse_args(argv)
+
+    values = train(args.batches, args.games, args.workers, args.learning_rate, method=args.method, rows=args.rows,
+                   cols=args.cols, k=args.k, move_radius=args.move_radius, seed=args.seed)
+    path = args.output or value_table_path(args.rows, args.cols, args.k)
+    ValueTable.from_dict(values, args.rows, args.cols, args.k).save(path)
+    print('wrote {0} positions to {1}'.format(len(values), path))
+
+    if args.evaluate:
+        import tournament  # imports the agents, which import this module
+
+        spec = 'learned:path={0}'.format(path)
+        if args.move_radius is not None:
+            spec += ',move_radius={0}'.format(args.move_radius)
+        opponents = ['random', 'onestep']
+        if (args.rows, args.cols, args.k) == (3, 3, 3):
+            opponents.append('tablebase')
+        for opponent in opponents:
+            report = tournament.run_tournament(spec, opponent, args.evaluate, workers=args.workers,
+                                               rows=args.rows, cols=args.cols, k=args.k)
+            tournament.print_report(report)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,306 @@
+"""
+A line-based protocol for running agents in separate engine processes, in the spirit of UCI
+
+Run as a script, this module is an engine: it reads commands from stdin and writes replies to stdout, one per line.
+    ttt                         -> 'id name ...' and 'tttok'; sent once after starting the engine
+    isready                     -> 'readyok' once all earlier commands are done
+    agent <spec>                selects the agent, described as in tournament.py (default 'nstep')
+    newgame                     tells the agent that a new game starts
+    position [size R C K] [moves r,c r,c ...]
+                                sets the position: the board size (default 3 3 3) and the moves from the empty board,
+                                counting rows and columns from 0
+    go [depth N] [movetime MS]  searches the position -> 'info time MS [nodes N]' and 'bestmove r,c'
+    quit                        stops the engine
+Errors are reported as 'error <message>'; a go that fails still ends with 'bestmove none'. A go with movetime fails
+for an agent that searches in parallel (with workers), as that search has no time limit.
+
+RemoteAgent plays through such engines. The engines are long-lived processes kept in an EnginePool, so a move
+pays neither for starting Python nor for importing the agents, and several engines can search side by side.
+
+Example:
+    python tictactoe_protocol.py
+"""
+
+import os
+import queue
+import subprocess
+import sys
+import threading
+import time
+
+import tictactoe_engine as te
+import tictactoe_agents as ta
+import tournament
+
+ENGINE_NAME = 'TicTacToe engine'
+
+
+def format_move(move):
+    return '{0},{1}'.format(*move)
+
+
+def parse_move(text):
+    row, col = text.split(',')
+    return int(row), int(col)
+
+
+class Engine:
+    """the engine side of the protocol: keeps an agent and a position and answers commands about them"""
+
+    def __init__(self):
+        self.spec = None
+        self.agent = None
+        self.defaults = {}  # the search limits the agent was created with, restored before every go
+        self.board = te.GameBoard()
+        self.select_agent('nstep')
+
+    def select_agent(self, spec):
+        if spec != self.spec:
+            self.agent = tournament.build_agent(spec)
+            self.spec = spec
+            self.defaults = {name: getattr(self.agent, name) for name in ('nsteps', 'time_limit_ms', 'playouts')
+                             if hasattr(self.agent, name)}
+
+    def set_position(self, words):
+        """sets the position; after a rejected position there is none, so go fails rather than search the old one"""
+        self.board = None
+        size = (3, 3, 3)
+        moves = []
+        i = 0
+        while i < len(words):
+            if words[i] == 'size':
+                size = tuple(int(word) for word in words[i + 1:i + 4])
+                i += 4
+            elif words[i] == 'moves':
+                moves = [parse_move(word) for word in words[i + 1:]]
+                break
+            else:
+                raise ValueError('unexpected {0} in position'.format(words[i]))
+
+        board = te.GameBoard(*size)
+        for move_row, move_col in moves:
+            if (move_row, move_col) not in board.get_legal_moves() or board.game_end():
+                raise ValueError('illegal move {0}'.format(format_move((move_row, move_col))))
+            board.place_piece(row=move_row, col=move_col, player=board.active_player)
+        self.board = board
+
+    def go(self, words):
+        """searches the current position and returns the reply lines"""
+        limits = dict(zip(words[::2], (int(word) for word in words[1::2])))
+        for name, value in self.defaults.items():
+            setattr(self.agent, name, value)
+        if 'depth' in limits and 'nsteps' in self.defaults:
+            self.agent.nsteps = limits['depth']
+        if 'movetime' in limits and 'time_limit_ms' in self.defaults:
+            if getattr(self.agent, 'workers', None) is not None:
+                # rather than search to the full depth, however long that takes
+                raise ValueError('movetime is not supported by the parallel search of an agent with workers')
+            self.agent.time_limit_ms = limits['movetime']
+
+        if self.board is None:
+            raise ValueError('no position: the last position command was rejected')
+        if self.board.game_end():
+            raise ValueError('the game is over')
+        start = time.perf_counter()
+        move = self.agent.make_move(self.board)
+        info = 'info time {0:.0f}'.format(1000 * (time.perf_counter() - start))
+        nodes = getattr(self.agent, 'node_count', getattr(self.agent, 'playout_count', None))
+        if nodes is not None:
+            info += ' nodes {0}'.format(nodes)
+        return [info, 'bestmove ' + format_move(move)]
+
+    def handle(self, line):
+        """carries out one command and returns the reply lines, or None for quit"""
+        command, *words = line.split()
+        if command == 'ttt':
+            return ['id name ' + ENGINE_NAME, 'tttok']
+        elif command == 'isready':
+            return ['readyok']
+        elif command == 'agent':
+            self.select_agent(' '.join(words))
+        elif command == 'newgame':
+            self.agent.new_game()
+        elif command == 'position':
+            self.set_position(words)
+        elif command == 'go':
+            try:
+                return self.go(words)
+            except Exception as error:
+                return ['error {0}'.format(error), 'bestmove none']
+        elif command == 'quit':
+            return None
+        else:
+            raise ValueError('unknown command {0}'.format(command))
+        return []
+
+
+def run_engine(input_file=sys.stdin, output_file=sys.stdout):
+    engine = Engine()
+    for line in input_file:
+        if not line.strip():
+            continue
+        try:
+            replies = engine.handle(line)
+        except Exception as error:
+            replies = ['error {0}'.format(error)]
+        if replies is None:
+            break
+        for reply in replies:
+            output_file.write(reply + '\n')
+        output_file.flush()
+
+
+class EngineProcess:
+    """an engine running in a child process"""
+
+    def __init__(self):
+        self.process = subprocess.Popen([sys.executable, os.path.abspath(__file__)], stdin=subprocess.PIPE,
+                                        stdout=subprocess.PIPE, universal_newlines=True, bufsize=1)
+        self.spec = None
+        self.last_user = None  # the RemoteAgent that used this engine last
+        self.send('ttt')
+        self.read_until('tttok')
+
+    def send(self, command):
+        self.process.stdin.write(command + '\n')
+        self.process.stdin.flush()
+
+    def read_until(self, prefix):
+        """reads reply lines up to and including the first one starting with prefix and returns them"""
+        lines = []
+        while True:
+            line = self.process.stdout.readline()
+            if not line:
+                raise RuntimeError('the engine process stopped')
+            lines.append(line.rstrip('\n'))
+            if line.startswith(prefix):
+                return lines
+
+    def alive(self):
+        return self.process.poll() is None
+
+    def close(self):
+        if self.alive():
+            try:
+                self.send('quit')
+                self.process.wait(timeout=5)
+            except (OSError, subprocess.TimeoutExpired):
+                self.process.kill()
+                self.process.wait()
+
+
+class EnginePool:
+    """
+    a fixed number of engine processes, started when they are first needed and then kept running.
+    acquire hands out an idle engine, waiting for one if they are all busy; the pool can be shared between threads.
+    """
+
+    def __init__(self, size=None):
+        self.size = size or os.cpu_count() or 1
+        self._idle = queue.LifoQueue()  # the engine released last is the one most likely to still be warm
+        self._started = 0
+        self._lock = threading.Lock()
+        self._engines = []
+
+    def acquire(self):
+        with self._lock:
+            if self._idle.empty() and self._started < self.size:
+                self._started += 1
+                engine = EngineProcess()
+                self._engines.append(engine)
+                return engine
+        return self._idle.get()
+
+    def release(self, engine):
+        if not engine.alive():
+            # replace an engine that died, so the pool keeps its size
+            with self._lock:
+                self._engines.remove(engine)
+                engine = EngineProcess()
+                self._engines.append(engine)
+        self._idle.put(engine)
+
+    def close(self):
+        with self._lock:
+            for engine in self._engines:
+                engine.close()
+            self._engines = []
+            self._started = 0
+            self._idle = queue.LifoQueue()
+
+
+_default_pool = None
+
+
+def default_pool():
+    """the pool that RemoteAgents use unless given their own"""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = EnginePool()
+    return _default_pool
+
+
+class RemoteAgent(ta.Agent):
+    """
+    This agent sends the position to an engine process and plays the move it answers with. spec describes the agent
+    the engine plays with, as in tournament.py; depth and movetime_ms are passed on with every go.
+    The info line of the last move is kept in self.info.
+    """
+
+    def __init__(self, name='Remote AI', spec='nstep', depth=None, movetime_ms=None, pool=None):
+        super().__init__(name=name)
+        self.player = 'computer'
+        self.spec = spec
+        self.depth = depth
+        self.movetime_ms = movetime_ms
+        self.pool = pool if pool is not None else default_pool()
+        self.info = {}
+        self._new_game = True
+
+    def new_game(self):
+        self._new_game = True
+
+    def make_move(self, board):
+        commands = []
+        engine = self.pool.acquire()
+        try:
+            if engine.spec != self.spec:
+                commands.append('agent ' + self.spec)
+            if self._new_game or engine.last_user is not self:
+                commands.append('newgame')
+            engine.last_user = self
+            self._new_game = False
+
+            position = 'position size {0} {1} {2}'.format(board.rows, board.cols, board.k)
+            if board.moves:
+                position += ' moves ' + ' '.join(format_move((row, col)) for row, col, _ in board.moves)
+            go = 'go'
+            if self.depth is not None:
+                go += ' depth {0}'.format(self.depth)
+            if self.movetime_ms is not None:
+                go += ' movetime {0}'.format(self.movetime_ms)
+
+            for command in commands + [position, go]:
+                engine.send(command)
+            replies = engine.read_until('bestmove')
+            errors = [reply[len('error '):] for reply in replies if reply.startswith('error ')]
+            # after an error the engine may have rejected the agent command and kept its previous agent
+            engine.spec = self.spec if not errors else None
+        except (OSError, RuntimeError):
+            engine.process.kill()
+            engine.process.wait()  # so that release sees it is dead and replaces it
+            raise
+        finally:
+            self.pool.release(engine)
+
+        if errors:
+            raise RuntimeError('the engine reported: {0}'.format('; '.join(errors)))
+        words = next((reply.split()[1:] for reply in replies if reply.startswith('info ')), [])
+        self.info = {name: int(value) for name, value in zip(words[::2], words[1::2])}
+        move = parse_move(replies[-1].split()[1])
+        self.announce_move(move)
+        return move
+
+
+if __name__ == '__main__':
+    run_engine()
@@ -0,0 +1,227 @@
+"""
+A compact binary format for storing many finished games
+
+A record file starts with a header giving the board size, followed by one record per game:
+    1 byte (2 bytes on boards of more than 255 squares): the number of moves
+    1 byte: the result in the low 2 bits (0: X won, 1: O won, 2: draw, 3: unfinished) and a tag of 0-63 in the
+            high 6 bits, free for the writer to use, e.g. to tell apart the pairings of a tournament
+    the moves as square indices (cols * row + col): two per byte on boards of at most 16 squares, low nibble first,
+            otherwise one byte each, or two bytes each on boards of more than 256 squares
+The players alternate, X first, so they are not stored. A game of 3x3 tic tac toe takes at most 7 bytes.
+
+GameRecordWriter appends records to a file, one game at a time; pass it to TicTacToe as recorder to store every game
+played. GameRecordReader maps a file into memory and iterates over, filters and replays the records in it.
+"""
+
+import mmap
+import struct
+from array import array
+from collections import namedtuple
+
+import tictactoe_engine as te
+
+MAGIC = b'TTTG'
+VERSION = 1
+HEADER = struct.Struct('<4sBBBB')  # magic, version, rows, cols, k
+RESULTS = {0: 0, 1: 1, -1: 2}  # winner -> result code; unfinished games get UNFINISHED
+UNFINISHED = 3
+MAX_TAG = 63
+
+# every byte split into its low and high nibble
+NIBBLES = tuple((byte & 0xF, byte >> 4) for byte in range(0, 256))
+
+GameRecord = namedtuple('GameRecord', ['squares', 'winner', 'finished', 'tag'])
+GameRecord.__doc__ = """
+a game read from a record file: the square index of every move, the winner (0 or 1, or -1 for a draw or an unfinished
+game), whether the game was finished and the tag it was written with
+"""
+
+
+def move_bytes(num_squares):
+    """the number of bytes per move on a board of num_squares squares; 0.5 means two moves per byte"""
+    if num_squares <= 16:
+        return 0.5
+    return 1 if num_squares <= 256 else 2
+
+
+class GameRecordWriter:
+    """
+    Appends games to a record file for boards of the given size. If the file already holds games for the same
+    board size they are kept; use the writer as a context manager, or call close, to make sure all games are written.
+    """
+
+    def __init__(self, path, rows=3, cols=3, k=3):
+        self.rows = rows
+        self.cols = cols
+        self.k = k
+        self.num_squares = rows * cols
+        self.move_bytes = move_bytes(self.num_squares)
+        self.count_format = struct.Struct('<B' if self.num_squares <= 255 else '<H')
+        self.games_written = 0
+
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER.pack(MAGIC, VERSION, rows, cols, k))
+        else:
+            with open(path, 'rb') as existing:
+                header = read_header(existing.read(HEADER.size))
+            if header != (rows, cols, k):
+                self.file.close()
+                raise ValueError('{0} holds games on a different board: {1}'.format(path, header))
+
+    def write_game(self, squares, winner, finished=True, tag=0):
+        """appends a game given as the square index of every move and its winner (-1 for a draw)"""
+        if not 0 <= tag <= MAX_TAG:
+            raise ValueError('the tag must be between 0 and {0}'.format(MAX_TAG))
+        result = RESULTS[winner] if finished else UNFINISHED
+        record = bytearray(self.count_format.pack(len(squares)))
+        record.append(tag << 2 | result)
+
+        if self.move_bytes == 0.5:
+            for i in range(0, len(squares) - 1, 2):
+                record.append(squares[i] | squares[i + 1] << 4)
+            if len(squares) % 2:
+                record.append(squares[-1])
+        elif self.move_bytes == 1:
+            record.extend(squares)
+        else:
+            record.extend(array('H', squares).tobytes())
+        self.file.write(record)
+        self.games_written += 1
+
+    def record(self, board, tag=0):
+        """appends the game played on a GameBoard; called by TicTacToe.play_game when this writer is its recorder"""
+        if (board.rows, board.cols, board.k) != (self.rows, self.cols, self.k):
+            raise ValueError('the game was played on a different board than this file holds')
+        self.write_game([board.cols * row + col for row, col, _ in board.moves], board.winner, board.game_end(), tag)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def read_header(data):
+    """(rows, cols, k) from the header of a record file"""
+    if len(data) < HEADER.size:
+        raise ValueError('not a game record file')
+    magic, version, rows, cols, k = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError('not a game record file')
+    if version != VERSION:
+        raise ValueError('unsupported game record version {0}'.format(version))
+    return rows, cols, k
+
+
+class GameRecordReader:
+    """
+    Reads a record file through a memory map. Iterating gives a GameRecord per game; filter selects games by result,
+    opening or tag, and replay turns a record back into a GameBoard.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as record_file:
+            self.rows, self.cols, self.k = read_header(record_file.read(HEADER.size))
+            self.data = mmap.mmap(record_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self.num_squares = self.rows * self.cols
+        self.move_bytes = move_bytes(self.num_squares)
+        self.count_size = 1 if self.num_squares <= 255 else 2
+        self._offsets = None
+
+    def record_size(self, num_moves):
+        if self.move_bytes == 0.5:
+            return self.count_size + 1 + (num_moves + 1) // 2
+        return self.count_size + 1 + num_moves * self.move_bytes
+
+    def offsets(self):
+        """the offset of every record in the file; computed on first use"""
+        if self._offsets is None:
+            offsets = array('Q')
+            data = self.data
+            offset = HEADER.size
+            while offset < len(data):
+                offsets.append(offset)
+                num_moves = data[offset] if self.count_size == 1 else data[offset] | data[offset + 1] << 8
+                offset += self.record_size(num_moves)
+            self._offsets = offsets
+        return self._offsets
+
+    def __len__(self):
+        return len(self.offsets())
+
+    def __getitem__(self, index):
+        return self.read_record(self.offsets()[index])[0]
+
+    def __iter__(self):
+        offset = HEADER.size
+        end = len(self.data)
+        while offset < end:
+            record, offset = self.read_record(offset)
+            yield record
+
+    def read_record(self, offset, max_moves=None):
+        """the record at offset, with at most max_moves of its moves decoded, and the offset of the next record"""
+        data = self.data
+        if self.count_size == 1:
+            num_moves = data[offset]
+        else:
+            num_moves = data[offset] | data[offset + 1] << 8
+        flags = data[offset + self.count_size]
+        start = offset + self.count_size + 1
+        next_offset = offset + self.record_size(num_moves)
+
+        decode = num_moves if max_moves is None else min(num_moves, max_moves)
+        if self.move_bytes == 0.5:
+            squares = []
+            for byte in data[start:start + (decode + 1) // 2]:
+                squares.extend(NIBBLES[byte])
+            del squares[decode:]
+        elif self.move_bytes == 1:
+            squares = list(data[start:start + decode])
+        else:
+            squares = array('H', data[start:start + 2 * decode]).tolist()
+
+        result = flags & 3
+        winner = result if result < 2 else -1
+        return GameRecord(squares, winner, result != UNFINISHED, flags >> 2), next_offset
+
+    def filter(self, winner=None, opening=None, tag=None, finished=None):
+        """
+        yields the records of the games with the given winner (-1 for draws), tag and finished flag that started with
+        opening, a sequence of (row, col) moves. Only as many moves as the opening has are decoded to check it; the
+        records that match are decoded in full.
+        """
+        opening = [self.cols * row + col for row, col in opening] if opening else []
+        max_moves = len(opening) if opening else None
+        offset = HEADER.size
+        end = len(self.data)
+        while offset < end:
+            record, next_offset = self.read_record(offset, max_moves=max_moves)
+            if ((winner is None or (record.winner == winner and record.finished)) and
+                    (tag is None or record.tag == tag) and
+                    (finished is None or record.finished == finished) and
+                    record.squares[:len(opening)] == opening):
+                if opening:
+                    record = self.read_record(offset)[0]
+                yield record
+            offset = next_offset
+
+    def replay(self, record):
+        """the GameBoard with the moves of record played on it"""
+        board = te.GameBoard(rows=self.rows, cols=self.cols, k=self.k)
+        for square in record.squares:
+            board.place_piece(row=square // self.cols, col=square % self.cols, player=board.active_player)
+        return board
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
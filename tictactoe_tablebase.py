@@ -0,0 +1,103 @@
+"""
+Precomputed perfect-play table for tic-tac-toe
+
+Every position that can be reached from the empty board is solved once and its value is stored as a single signed
+byte at the index of its canonical (rotation and reflection reduced) position. The table can be memory-mapped so an
+agent can look up the value of any position without searching.
+
+Run this file to (re)generate the table on disk.
+"""
+
+import mmap
+import os
+
+import tictactoe_engine as te
+
+GEOMETRY = te.get_geometry(3, 3, 3)  # the table covers the standard board only
+TABLEBASE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'tictactoe_tablebase.bin')
+TABLE_SIZE = 3 ** GEOMETRY.num_squares  # one byte for every way of filling the squares with '.', 'X' or 'O'
+UNKNOWN = -128  # stored for indices that are not canonical reachable positions
+
+# TERNARY[bits] is the base-3 number with a 1 in every digit whose square is set in bits
+TERNARY = tuple(sum(3 ** i for i in range(0, GEOMETRY.num_squares) if bits >> i & 1)
+                for bits in range(GEOMETRY.full_board + 1))
+
+
+def position_index(board):
+    """returns the table index of the canonical form of the position on board"""
+    key = board.canonical_key()
+    return TERNARY[key & GEOMETRY.full_board] + 2 * TERNARY[key >> GEOMETRY.num_squares]
+
+
+def solve_position(board, values):
+    """
+    computes the value of the position on board for the player to move, filling in values (a mutable table) for
+    every position reachable from it.
+
+    The values match NStepAgent's scores: a win is worth 100 minus the number of moves in the finished game,
+    a loss minus that amount, and a draw 0. So faster wins and slower losses are preferred.
+    """
+    index = position_index(board)
+    if values[index] != UNKNOWN:
+        return values[index]
+
+    if board.game_end():
+        if board.winner == -1:
+            value = 0
+        else:
+            # the player who just moved has won, so the player to move has lost
+            value = -100 + len(board.moves)
+    else:
+        value = -100
+        for move_row, move_col in board.get_legal_moves():
+            board.place_piece(row=move_row, col=move_col, player=board.active_player)
+            value = max(value, -solve_position(board, values))
+            board.undo_move()
+
+    values[index] = value
+    return value
+
+
+def build_tablebase():
+    """solves every position reachable from the empty board and returns the table as bytes"""
+    values = [UNKNOWN] * TABLE_SIZE
+    solve_position(te.GameBoard(), values)
+    return bytes(value & 0xff for value in values)
+
+
+def write_tablebase(path=TABLEBASE_PATH):
+    """builds the table and writes it to path"""
+    table = build_tablebase()
+    with open(path, 'wb') as table_file:
+        table_file.write(table)
+    return table
+
+
+def load_tablebase(path=TABLEBASE_PATH):
+    """
+    memory-maps the table stored at path. If there is no file at path the table is built in memory instead,
+    which takes a fraction of a second.
+    """
+    if not os.path.exists(path):
+        return build_tablebase()
+
+    with open(path, 'rb') as table_file:
+        table = mmap.mmap(table_file.fileno(), 0, access=mmap.ACCESS_READ)
+    if len(table) != TABLE_SIZE:
+        table.close()
+        raise ValueError('{0} is not a tic-tac-toe table: expected {1} bytes'.format(path, TABLE_SIZE))
+    return table
+
+
+def lookup(table, board):
+    """returns the stored value of the position on board for the player to move"""
+    if (board.rows, board.cols, board.k) != (GEOMETRY.rows, GEOMETRY.cols, GEOMETRY.k):
+        raise ValueError('the tablebase only covers the 3x3 board')
+    value = table[position_index(board)]
+    return value - 256 if value > 127 else value
+
+
+if __name__ == '__main__':
+    written = write_tablebase()
+    num_positions = sum(1 for value in written if value != UNKNOWN & 0xff)
+    print('Wrote {0} canonical positions to {1}'.format(num_positions, TABLEBASE_PATH))
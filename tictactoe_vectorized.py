@@ -0,0 +1,218 @@
+"""
+NumPy versions of the engine and heuristics that work on many boards at once
+
+A board is a row of num_squares int8 values, in square index order (cols * row + col):
+1 for an 'X' (player 0), -1 for an 'O' (player 1) and 0 for an empty square.
+A batch of boards is an (N, num_squares) array.
+"""
+
+import functools
+
+import numpy as np
+
+import tictactoe_engine as te
+
+PIECE_VALUES = (1, -1)  # the value of a piece of player 0 and of player 1
+
+
+@functools.lru_cache(maxsize=None)
+def line_indices(geometry):
+    """an (L, k) array with the square indices of each of the L lines of geometry"""
+    return np.array([[index for index in range(0, geometry.num_squares) if line >> index & 1]
+                     for line in geometry.lines], dtype=np.intp)
+
+
+def encode_board(board):
+    """returns the position on a GameBoard as an int8 array"""
+    encoded = np.zeros(board.num_squares, dtype=np.int8)
+    for player, bits in enumerate(board.bitboards):
+        for index in range(0, board.num_squares):
+            if bits >> index & 1:
+                encoded[index] = PIECE_VALUES[player]
+    return encoded
+
+
+def batch_heuristic(boards, player, geometry=None, chunk_size=2 ** 16):
+    """
+    computes Agent.compute_heuristic for every board in boards, an (N, num_squares) int8 array, and returns the N
+    scores as a float array. player is the player whose perspective is scored, either one player for all boards or
+    an array with a player per board. geometry defaults to the 3x3 board.
+    The boards are processed chunk_size at a time to bound the memory used for intermediate arrays.
+    """
+    if geometry is None:
+        geometry = te.get_geometry()
+    boards = np.asarray(boards, dtype=np.int8)
+    player = np.broadcast_to(np.asarray(player), (len(boards),))
+    scores = np.empty(len(boards), dtype=np.float64)
+    for start in range(0, len(boards), chunk_size):
+        end = start + chunk_size
+        scores[start:end] = _heuristic_chunk(boards[start:end], player[start:end], geometry)
+    return scores
+
+
+def _heuristic_chunk(boards, player, geometry):
+    lines = line_indices(geometry)
+    cells = boards[:, lines]  # (N, L, k): the pieces on every line of every board
+    x_count = (cells == PIECE_VALUES[0]).sum(axis=2, dtype=np.int16)
+    o_count = (cells == PIECE_VALUES[1]).sum(axis=2, dtype=np.int16)
+
+    is_x = player == 0
+    player_count = np.where(is_x[:, None], x_count, o_count)
+    opponent_count = np.where(is_x[:, None], o_count, x_count)
+
+    # the same terminal scores as compute_heuristic: a win is 1e6 and anything else that ends the game -1e5
+    x_wins = (x_count == geometry.k).any(axis=1)
+    o_wins = (o_count == geometry.k).any(axis=1)
+    board_full = (boards != 0).all(axis=1)
+    player_wins = np.where(is_x, x_wins, o_wins)
+    game_over = x_wins | o_wins | board_full
+
+    threat = geometry.k - 1
+    num_twos = ((player_count == threat) & (opponent_count == 0)).sum(axis=1)
+    num_twos_opp = ((player_count == 0) & (opponent_count == threat)).sum(axis=1)
+    scores = 1e2 * num_twos - 1e3 * num_twos_opp
+
+    return np.where(game_over, np.where(player_wins, 1e6, -1e5), scores)
+
+
+def child_boards(board, moves):
+    """an array holding the position after each of moves (by the player to move) on a GameBoard, one per row"""
+    children = np.tile(encode_board(board), (len(moves), 1))
+    indices = [board.cols * move_row + move_col for move_row, move_col in moves]
+    children[np.arange(len(moves)), indices] = PIECE_VALUES[board.active_player]
+    return children
+
+
+class VectorGames:
+    """
+    Plays num_games games in lockstep, each stored as a row of the (num_games, num_squares) int8 array self.boards.
+    Every call of step places one piece in every game, for the player to move in that game. Games that end are
+    recorded in self.results and, with auto_reset, immediately start again from the empty board.
+
+    self.active_player, self.num_moves and self.winner hold the player to move, the number of pieces on the board
+    and the winner (0 or 1, or -1 while undecided or drawn) of every game; self.done marks the finished games
+    when auto_reset is off.
+    """
+
+    def __init__(self, num_games, rows=3, cols=3, k=3, auto_reset=True):
+        self.geometry = te.get_geometry(rows, cols, k)
+        self.num_games = num_games
+        self.auto_reset = auto_reset
+        self._lines = line_indices(self.geometry)
+        self.boards = np.zeros((num_games, self.geometry.num_squares), dtype=np.int8)
+        self.active_player = np.zeros(num_games, dtype=np.int8)
+        self.num_moves = np.zeros(num_games, dtype=np.int16)
+        self.winner = np.full(num_games, -1, dtype=np.int8)
+        self.done = np.zeros(num_games, dtype=bool)
+        self.results = {'x_wins': 0, 'o_wins': 0, 'draws': 0}
+        self._all_games = np.arange(num_games)
+
+    def reset(self, games=None):
+        """starts the given games (a boolean mask or index array; all games by default) from the empty board"""
+        if games is None:
+            games = slice(None)
+        self.boards[games] = 0
+        self.active_player[games] = 0
+        self.num_moves[games] = 0
+        self.winner[games] = -1
+        self.done[games] = False
+
+    def legal_moves(self):
+        """a (num_games, num_squares) boolean mask of the empty squares of the unfinished games"""
+        return (self.boards == 0) & ~self.done[:, None]
+
+    def place_pieces(self, actions):
+        """places a piece for the player to move in every unfinished game, on the square index given in actions"""
+        actions = np.asarray(actions)
+        playing = ~self.done
+        games = self._all_games[playing]
+        squares = actions[playing]
+        if (self.boards[games, squares] != 0).any():
+            raise ValueError('an action tries to place a piece on an occupied square')
+
+        pieces = np.where(self.active_player[games] == 0, PIECE_VALUES[0], PIECE_VALUES[1]).astype(np.int8)
+        self.boards[games, squares] = pieces
+        self.num_moves[games] += 1
+        self.active_player[games] = 1 - self.active_player[games]
+
+    def check_game_end(self):
+        """
+        finds the unfinished games that have been won or drawn, sets their winner and marks them done.
+        Returns the boolean mask of the games that ended
+        """
+        cells = self.boards[:, self._lines]  # (num_games, L, k)
+        line_sums = cells.sum(axis=2, dtype=np.int16)
+        x_wins = (line_sums == self.geometry.k * PIECE_VALUES[0]).any(axis=1)
+        o_wins = (line_sums == self.geometry.k * PIECE_VALUES[1]).any(axis=1)
+        board_full = self.num_moves == self.geometry.num_squares
+
+        ended = ~self.done & (x_wins | o_wins | board_full)
+        self.winner[ended & x_wins] = 0
+        self.winner[ended & o_wins] = 1
+        self.done |= ended
+        return ended
+
+    def step(self, actions):
+        """
+        places the pieces given by actions (a square index per game) and detects the games that ended.
+        Returns (ended, winner): the mask of the games that ended with this move and the winner of every game
+        (meaningful where ended is set). With auto_reset the games that ended are then started again
+        """
+        self.place_pieces(actions)
+        ended = self.check_game_end()
+        winner = self.winner.copy()
+
+        ended_winners = winner[ended]
+        self.results['x_wins'] += int((ended_winners == 0).sum())
+        self.results['o_wins'] += int((ended_winners == 1).sum())
+        self.results['draws'] += int((ended_winners == -1).sum())
+        if self.auto_reset:
+            self.reset(ended)
+        return ended, winner
+
+    def play(self, policies, num_steps, rng=None):
+        """
+        advances all games num_steps times, letting policies[0] move for X and policies[1] for O. A policy is a
+        function (games, rng) -> actions returning a square index for every game; only the actions for games in which
+        its player is to move are used. Returns self.results
+        """
+        if rng is None:
+            rng = np.random.default_rng()
+        for _ in range(0, num_steps):
+            actions = policies[0](self, rng)
+            if policies[1] is not policies[0]:
+                actions = np.where(self.active_player == 0, actions, policies[1](self, rng))
+            self.step(actions)
+        return self.results
+
+
+def _pick_best(scores, rng):
+    """the index of the highest score in every row, chosen at random among ties"""
+    best = scores == scores.max(axis=1, keepdims=True)
+    return np.where(best, rng.random(scores.shape), -1.0).argmax(axis=1)
+
+
+def random_policy(games, rng):
+    """plays a random legal move in every game, like RandomAgent"""
+    legal = games.legal_moves()
+    return np.where(legal, rng.random(legal.shape), -1.0).argmax(axis=1)
+
+
+def one_step_policy(games, rng):
+    """
+    plays the move with the best compute_heuristic score in every game, picking at random among equally good moves,
+    like OneStepAgent
+    """
+    num_games, num_squares = games.boards.shape
+    legal = games.legal_moves()
+
+    # the position after every move in every game: (num_games * num_squares) boards
+    children = np.repeat(games.boards, num_squares, axis=0).reshape(num_games, num_squares, num_squares)
+    pieces = np.where(games.active_player == 0, PIECE_VALUES[0], PIECE_VALUES[1]).astype(np.int8)
+    squares = np.arange(num_squares)
+    children[:, squares, squares] = np.where(legal, pieces[:, None], children[:, squares, squares])
+
+    scores = batch_heuristic(children.reshape(-1, num_squares), np.repeat(games.active_player, num_squares),
+                             games.geometry).reshape(num_games, num_squares)
+    scores[~legal] = -np.inf
+    return _pick_best(scores, rng)
@@ -0,0 +1,210 @@
+"""
+Headless tournaments between two agent configurations
+
+Plays a number of games between two agents without printing anything, optionally spread over several processes,
+and reports the results, the number of games per second and how long the agents took per move.
+Every game is seeded on its own, so a tournament gives the same results however the games are spread over workers.
+
+Example:
+    python tournament.py nstep:nsteps=2 random --games 1000 --workers 4
+"""
+
+import argparse
+import ast
+import json
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import tictactoe_engine as te
+import tictactoe_agents as ta
+
+AGENT_TYPES = {
+    'random': ta.RandomAgent,
+    'onestep': ta.OneStepAgent,
+    'nstep': ta.NStepAgent,
+    'tablebase': ta.TablebaseAgent,
+    'mcts': ta.MCTSAgent,
+    'learned': ta.LearnedAgent,
+}
+GAME_SEED_STRIDE = 1000003  # game i of a tournament with seed s is seeded with s * GAME_SEED_STRIDE + i
+LATENCY_PERCENTILES = (50, 90, 99)
+
+_kept_agents = {}  # (spec_1, spec_2) -> the agents play_games keeps for later calls with keep_agents, per process
+
+
+def parse_agent_spec(spec):
+    """
+    turns an agent description like 'nstep:nsteps=4,ordering=history' into ('nstep', {'nsteps': 4, ...}).
+    Values are read as Python literals where possible and as strings otherwise.
+    """
+    agent_type, _, options = spec.partition(':')
+    if agent_type not in AGENT_TYPES:
+        raise ValueError('unknown agent type {0}, choose from {1}'.format(agent_type, ', '.join(AGENT_TYPES)))
+
+    kwargs = {}
+    for option in filter(None, options.split(',')):
+        key, separator, value = option.partition('=')
+        if not separator:
+            raise ValueError('agent options must look like key=value, got {0}'.format(option))
+        try:
+            kwargs[key.strip()] = ast.literal_eval(value.strip())
+        except (ValueError, SyntaxError):
+            kwargs[key.strip()] = value.strip()
+    return agent_type, kwargs
+
+
+def build_agent(spec):
+    """creates a silent agent from a description accepted by parse_agent_spec"""
+    agent_type, kwargs = parse_agent_spec(spec)
+    agent = AGENT_TYPES[agent_type](**kwargs)
+    agent.announce_moves = False
+    return agent
+
+
+class TimedAgent:
+    """wraps an agent and records how long each of its moves took, in seconds"""
+
+    def __init__(self, agent):
+        self.agent = agent
+        self.name = agent.name
+        self.latencies = []
+
+    def new_game(self):
+        self.agent.new_game()
+
+    def make_move(self, board):
+        start = time.perf_counter()
+        move = self.agent.make_move(board)
+        self.latencies.append(time.perf_counter() - start)
+        return move
+
+
+def play_games(spec_1, spec_2, game_indices, seed=0, rows=3, cols=3, k=3, keep_agents=False):
+    """
+    plays the given games of a tournament between the agents described by spec_1 and spec_2. Agent 1 moves first
+    in the even-numbered games and second in the odd-numbered ones.
+    Returns the outcome of each game for agent 1 (1 for a win, 0 for a draw, -1 for a loss) and both agents' move times
+    With keep_agents the agents are kept in this process for the next call with the same specs instead of being
+    built on every call. They are still closed at the end of every call, which only releases what they open again
+    when needed, like the process pool of a parallel NStepAgent.
+    """
+    agents = _kept_agents.get((spec_1, spec_2)) if keep_agents else None
+    if agents is None:
+        agents = [TimedAgent(build_agent(spec_1)), TimedAgent(build_agent(spec_2))]
+        if keep_agents:
+            _kept_agents[(spec_1, spec_2)] = agents
+    for timed_agent in agents:
+        timed_agent.latencies = []
+    outcomes = []
+    for game_index in game_indices:
+        random.seed(seed * GAME_SEED_STRIDE + game_index)
+        agent_1_first = game_index % 2 == 0
+        players = agents if agent_1_first else agents[::-1]
+        winner = te.TicTacToe(players[0], players[1], rows=rows, cols=cols, k=k, verbose=False).play_game()
+        if winner == -1:
+            outcomes.append(0)
+        elif (winner == 0) == agent_1_first:
+            outcomes.append(1)
+        else:
+            outcomes.append(-1)
+
+    for timed_agent in agents:
+        close = getattr(timed_agent.agent, 'close', None)
+        if close is not None:
+            close()
+    return outcomes, agents[0].latencies, agents[1].latencies
+
+
+def percentile(values, q):
+    """the q-th percentile of values, by the nearest-rank method"""
+    if not values:
+        return float('nan')
+    ordered = sorted(values)
+    rank = max(1, -(-q * len(ordered) // 100))
+    return ordered[int(rank) - 1]
+
+
+def run_tournament(spec_1, spec_2, num_games, workers=None, seed=0, rows=3, cols=3, k=3, first_game=0,
+                   chunk_size=None, pool=None, keep_agents=False):
+    """
+    plays num_games games, numbered from first_game, between the agents described by spec_1 and spec_2 and returns
+    a dict with the outcomes for agent 1, the win/draw/loss counts, games per second and move time percentiles.
+    With workers set the games are split into chunks that are played by a pool of that many processes: pool if it
+    is given, otherwise one started for this tournament. To play several tournaments between the same agents, pass
+    the same pool and keep_agents to each, so the agents are built once per process (see play_games).
+    """
+    game_indices = list(range(first_game, first_game + num_games))
+    start = time.perf_counter()
+
+    if workers is None or workers <= 1:
+        chunk_results = [play_games(spec_1, spec_2, game_indices, seed, rows, cols, k, keep_agents)]
+    else:
+        if chunk_size is None:
+            chunk_size = max(1, -(-num_games // (4 * workers)))
+        chunks = [game_indices[i:i + chunk_size] for i in range(0, num_games, chunk_size)]
+        own_pool = pool is None
+        if own_pool:
+            pool = ProcessPoolExecutor(max_workers=workers)
+        try:
+            futures = [pool.submit(play_games, spec_1, spec_2, chunk, seed, rows, cols, k, keep_agents)
+                       for chunk in chunks]
+            chunk_results = [future.result() for future in futures]
+        finally:
+            if own_pool:
+                pool.shutdown()
+
+    elapsed = time.perf_counter() - start
+    outcomes = [outcome for chunk_outcomes, _, _ in chunk_results for outcome in chunk_outcomes]
+    latencies = [[latency for result in chunk_results for latency in result[1]],
+                 [latency for result in chunk_results for latency in result[2]]]
+
+    report = {
+        'agents': [spec_1, spec_2],
+        'games': num_games,
+        'wins': outcomes.count(1),
+        'draws': outcomes.count(0),
+        'losses': outcomes.count(-1),
+        'seconds': elapsed,
+        'games_per_second': num_games / elapsed if elapsed > 0 else float('inf'),
+        'move_latency_ms': [{'p{0}'.format(q): 1000 * percentile(agent_latencies, q) for q in LATENCY_PERCENTILES}
+                            for agent_latencies in latencies],
+        'outcomes': outcomes,
+    }
+    return report
+
+
+def print_report(report):
+    print('{0} vs {1}: {2} games'.format(report['agents'][0], report['agents'][1], report['games']))
+    print('wins {0}, draws {1}, losses {2} (for {3})'.format(report['wins'], report['draws'], report['losses'],
+                                                            report['agents'][0]))
+    print('{0:.1f} games per second'.format(report['games_per_second']))
+    for spec, latency in zip(report['agents'], report['move_latency_ms']):
+        print('move time of {0} in ms: {1}'.format(
+            spec, ', '.join('{0} {1:.3f}'.format(name, value) for name, value in latency.items())))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Play a headless tournament between two agents.')
+    parser.add_argument('agent_1', help='first agent, e.g. random, onestep, tablebase, mcts or nstep:nsteps=4')
+    parser.add_argument('agent_2', help='second agent, in the same format')
+    parser.add_argument('--games', type=int, default=100, help='number of games to play')
+    parser.add_argument('--workers', type=int, default=None, help='number of processes to play the games in')
+    parser.add_argument('--seed', type=int, default=0, help='seed that all game seeds are derived from')
+    parser.add_argument('--rows', type=int, default=3)
+    parser.add_argument('--cols', type=int, default=3)
+    parser.add_argument('--k', type=int, default=3, help='number of pieces in a row needed to win')
+    parser.add_argument('--json', action='store_true', help='print the report as JSON')
+    args = parser.parse_args(argv)
+
+    report = run_tournament(args.agent_1, args.agent_2, args.games, workers=args.workers, seed=args.seed,
+                            rows=args.rows, cols=args.cols, k=args.k)
+    if args.json:
+        del report['outcomes']
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == '__main__':
+    main()